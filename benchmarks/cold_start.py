@@ -0,0 +1,80 @@
+"""
+Measures the cold start of a worker, from a fresh Python process to its first encoded page.
+
+Each measurement runs in a new process, with downloads disabled so that the text model and the Punkt tokenizer are
+read from the local copies installed by `python -m webleaf.model.TextModel`. The following are measured, keeping
+the best of `--repeat` runs:
+
+- import: `import webleaf`, which must not import the models.
+- first_web: `import webleaf` followed by the first `Web(html)`, which loads the models.
+
+Like run_benchmarks.py, the results can be written to a JSON file and compared to a previous one, failing when a
+measurement regressed by more than the tolerance.
+
+Usage:
+    python benchmarks/cold_start.py --output cold_start.json
+    python benchmarks/cold_start.py --baseline cold_start.json --tolerance 0.25
+"""
+import os
+import sys
+# The scripts run from a checkout of the repository, where webleaf is not necessarily installed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from run_benchmarks import compare, environment
+import argparse
+import json
+import subprocess
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "example.html")
+
+# The code timed in a fresh process for each measurement, given the path of the page
+MEASUREMENTS = {
+    "import": "import webleaf",
+    "first_web": "import webleaf; webleaf.Web(open({page!r}, encoding='utf-8').read())",
+}
+
+
+def time_in_process(code):
+    """
+    Returns the time, in seconds, a new Python process takes to run some code, without starting the interpreter.
+    """
+    timed = f"import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"
+    env = dict(os.environ, WEBLEAF_DOWNLOAD="0", PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.run([sys.executable, "-c", timed], check=True, capture_output=True, text=True,
+                            env=env).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page", default=EXAMPLE_PATH, help="The HTML file encoded by first_web.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="The fraction a measurement can grow by before it counts as a regression.")
+    args = parser.parse_args()
+
+    results = {"cold_start": {name: min(time_in_process(code.format(page=os.path.abspath(args.page)))
+                                        for _ in range(args.repeat))
+                              for name, code in MEASUREMENTS.items()}}
+    print("cold_start: " + ", ".join(f"{name} {value * 1000:.1f}ms" for name, value in results["cold_start"].items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["environment"] != environment():
+            print("Warning: the baseline was measured in a different environment.")
+        print()
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(line for lines in regressions.values() for line in lines))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
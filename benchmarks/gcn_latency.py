@@ -0,0 +1,50 @@
+"""
+Compares the latency of the eager and traced GCN backends on synthetic pages of growing size.
+
+For each node count the GCN runs over the graph of a synthetic page (see synthetic_pages.py) with random input
+features, keeping the best of `--repeat` runs of each backend. The largest difference between the features of
+the two backends is reported with the timings.
+
+Usage:
+    python benchmarks/gcn_latency.py --sizes 100 1000 10000 100000
+"""
+import os
+import sys
+# The scripts run from a checkout of the repository, where webleaf is not necessarily installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_pages import generate_page, KINDS
+from stub_text_model import stub_text_embedding_model
+from run_benchmarks import best_time
+from webleaf import WebLeafRuntime
+from webleaf.model.WebGraphAutoEncoder import build_graph, union_edge_index, TEXT_DIMS, TAG_DIMS
+from lxml import etree
+import argparse
+import torch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--kind", choices=KINDS, default="product")
+    parser.add_argument("--gcn-precision", default="float32")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    encoders = {backend: WebLeafRuntime(text_embedding_model=stub_text_embedding_model(), gcn_backend=backend,
+                                        gcn_precision=args.gcn_precision).encoder for backend in ["eager", "traced"]}
+    print(f"{'nodes':>8} {'eager ms':>10} {'traced ms':>10} {'speedup':>8} {'max diff':>10}")
+    for nodes in args.sizes:
+        graph = build_graph(etree.ElementTree(etree.HTML(generate_page(nodes, args.kind))))
+        input_features = torch.randn((len(graph), TEXT_DIMS + TAG_DIMS), generator=torch.Generator().manual_seed(0))
+        edge_index = union_edge_index([graph])
+        times, features = {}, {}
+        for backend, encoder in encoders.items():
+            features[backend] = encoder.run_gcn(input_features, edge_index).float()
+            times[backend] = best_time(lambda: encoder.run_gcn(input_features, edge_index), args.repeat)
+        difference = (features["eager"] - features["traced"]).abs().max().item()
+        print(f"{len(graph):>8} {times['eager'] * 1000:>10.3f} {times['traced'] * 1000:>10.3f} "
+              f"{times['eager'] / times['traced']:>7.2f}x {difference:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
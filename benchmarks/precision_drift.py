@@ -0,0 +1,100 @@
+"""
+Measures how far the reduced precision inference modes drift from float32.
+
+Every page is encoded with the float32 models and with each reduced precision mode. The leaves of the float32
+encoding are then looked up in both encodings with `find_many`, and the results are compared:
+
+- max diff: the largest absolute difference between the float32 and reduced precision features.
+- top-1: the fraction of leaves for which `find` returns the same element.
+- top-n: the mean fraction of the `find_n` results shared with float32.
+
+Usage:
+    python benchmarks/precision_drift.py [held out pages ...] [--n 5]
+"""
+import os
+import sys
+# The scripts run from a checkout of the repository, where webleaf is not necessarily installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from webleaf import Web, WebLeafRuntime
+from webleaf.model.TagModel import TagEmbeddingModel
+from webleaf.model.TextModel import TextEmbeddingModel
+import argparse
+import glob
+import time
+import numpy as np
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "example.html")
+
+# The reduced precision modes compared to float32
+MODES = {
+    "int8 text": dict(text_precision="int8"),
+    "bfloat16 gcn": dict(gcn_precision="bfloat16"),
+    "float16 gcn": dict(gcn_precision="float16"),
+    "float16 output": dict(output_precision="float16"),
+    "int8 text, bfloat16 gcn, float16 output": dict(text_precision="int8", gcn_precision="bfloat16",
+                                                    output_precision="float16"),
+}
+
+
+def drift(reference, web, n):
+    """
+    Compares the `find` and `find_n` results of a reduced precision encoding to the float32 one.
+
+    Parameters:
+    -----------
+    reference : Web
+        The page encoded in float32.
+    web : Web
+        The same page encoded with reduced precision.
+    n : int
+        The number of results compared for `find_n`.
+
+    Returns:
+    --------
+    tuple
+        The max absolute feature difference, the top-1 agreement and the mean top-n overlap.
+    """
+    leaves = reference.leaves
+    expected, found = reference.find_many(leaves, n), web.find_many(leaves, n)
+    top_1 = np.mean([a[0] == b[0] for a, b in zip(expected, found)])
+    top_n = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(expected, found)])
+    max_diff = np.abs(reference.matrix.astype(np.float32) - web.matrix.astype(np.float32)).max()
+    return max_diff, top_1, top_n
+
+
+def encode(htmls, runtime):
+    runtime.warmup()
+    start = time.perf_counter()
+    webs = [Web(html, runtime=runtime) for html in htmls]
+    return webs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="Glob patterns of held out HTML pages, on top of tests/example.html.")
+    parser.add_argument("--n", type=int, default=5, help="The number of results compared for find_n.")
+    args = parser.parse_args()
+
+    paths = [EXAMPLE_PATH] + sorted(path for pattern in args.pages for path in glob.glob(pattern))
+    htmls = [open(path, encoding="utf-8").read() for path in paths]
+
+    # The models are shared between the modes, only the int8 text model is loaded separately
+    tag_model = TagEmbeddingModel()
+    text_models = {"float32": TextEmbeddingModel()}
+    references, reference_time = encode(htmls, WebLeafRuntime(tag_model, text_models["float32"]))
+    print(f"{len(paths)} pages, float32 encoding in {reference_time:.3f}s\n")
+    print(f"{'mode':<42}{'time':>9}{'max diff':>11}{'top-1':>8}{f'top-{args.n}':>8}")
+
+    for name, precision in MODES.items():
+        text_precision = precision.get("text_precision", "float32")
+        if text_precision not in text_models:
+            text_models[text_precision] = TextEmbeddingModel(precision=text_precision)
+        runtime = WebLeafRuntime(tag_model, text_models[text_precision], **precision)
+        webs, duration = encode(htmls, runtime)
+        results = np.array([drift(reference, web, args.n) for reference, web in zip(references, webs)])
+        max_diff, top_1, top_n = results[:, 0].max(), results[:, 1].mean(), results[:, 2].mean()
+        print(f"{name:<42}{duration:>8.3f}s{max_diff:>11.5f}{top_1:>8.3f}{top_n:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Benchmarks the traversal, embedding and search paths of WebLeaf on synthetic pages.
+
+Every case is a synthetic page (see synthetic_pages.py) encoded with a stub sentence transformer (see
+stub_text_model.py), so the results do not depend on the network or on the text model, while the sentence
+splitting and the text embedding cache are the real ones. For each case the following are measured, keeping the
+best of `--repeat` runs:
+
+- parse: parsing the HTML and building its graph.
+- embed: building the text and tag input features, the texts being split and looked up in the text cache.
+- gcn: running the GCN.
+- construct: the whole `Web(html)` construction.
+- leaf: one `web.leaf(xpath=...)` lookup.
+- leaves_for: one lookup of a `web.leaves_for(xpaths)` call for 32 XPaths.
+- find_n: one `web.find_n(leaf, 10)` search.
+- find_many: one `web.find_many(leaves, 10)` search for 32 leaves.
+- memory: how far constructing the page raises the peak resident memory above the resident memory before, in
+  bytes. This covers the tensors of torch as well as Python and NumPy. It is measured in a fresh process, so that
+  the memory freed by the other measurements does not hide it. On Linux the peak is reset right before the page
+  is constructed, elsewhere the peak of starting the process can hide the peak of small pages.
+
+Each timing is the shortest of `--repeat` samples, a sample calling the function in a loop for at least
+MIN_SAMPLE_TIME seconds so that short functions are not dominated by timer noise. The results can be written to a
+JSON file and compared to a previous one, failing when a measurement regressed by more than the tolerance. The
+cases that seem to regress are measured again, up to `--confirm` times, keeping the best of each measurement, so
+that a noisy run does not fail on its own.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json --tolerance 0.25
+"""
+import os
+import sys
+# The scripts run from a checkout of the repository, where webleaf is not necessarily installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_pages import generate_page, KINDS
+from stub_text_model import stub_text_embedding_model
+from webleaf import Web, WebLeafRuntime
+from webleaf.model.WebGraphAutoEncoder import build_graph, union_edge_index
+from lxml import etree
+import argparse
+import gc
+import json
+import platform
+import random
+import re
+import subprocess
+import time
+import torch
+
+# The number of leaves looked up and searched for in each case
+QUERIES = 32
+# The minimum duration, in seconds, of a timed sample
+MIN_SAMPLE_TIME = 0.2
+
+
+def best_time(function, repeat):
+    """
+    Returns the shortest time, in seconds, of one call of a function over `repeat` samples.
+    """
+    # Double the number of calls per sample until a sample lasts long enough
+    loops = 1
+    while True:
+        sample = time_loops(function, loops)
+        if sample * loops >= MIN_SAMPLE_TIME:
+            break
+        loops *= 2
+    return min([sample] + [time_loops(function, loops) for _ in range(repeat - 1)])
+
+
+def time_loops(function, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        function()
+    return (time.perf_counter() - start) / loops
+
+
+def memory_status(field):
+    # The value of a field of /proc/self/status, in bytes
+    with open("/proc/self/status", encoding="ascii") as status:
+        return int(re.search(rf"^{field}:\s+(\d+) kB", status.read(), re.MULTILINE).group(1)) * 1024
+
+
+def peak_memory(function):
+    """
+    Returns how far calling a function raises the peak resident memory of the process above its current one.
+    """
+    gc.collect()
+    try:
+        # Resets the peak resident memory of the process to its current value, on Linux only
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        function()
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale - before
+    before = memory_status("VmRSS")
+    function()
+    return memory_status("VmHWM") - before
+
+
+def run_case(runtime, kind, nodes, depth, fanout, duplication, repeat):
+    """
+    Measures a synthetic page, returning a dictionary of measurements.
+    """
+    html = generate_page(nodes, kind, depth, fanout, duplication)
+    encoder = runtime.encoder
+    results = {}
+
+    graph = build_graph(etree.ElementTree(etree.HTML(html)))
+    results["parse"] = best_time(lambda: build_graph(etree.ElementTree(etree.HTML(html))), repeat)
+    results["embed"] = best_time(lambda: encoder.embed(graph.texts, graph.tag_ids), repeat)
+    input_features, edge_index = encoder.embed(graph.texts, graph.tag_ids), union_edge_index([graph])
+    results["gcn"] = best_time(lambda: encoder.run_gcn(input_features, edge_index), repeat)
+    results["construct"] = best_time(lambda: Web(html, runtime=runtime), repeat)
+
+    web = Web(html, runtime=runtime)
+    rng = random.Random(0)
+    paths = rng.sample(web.paths, min(QUERIES, len(web.paths)))
+    leaves = [web.leaf(xpath=path) for path in paths]
+    results["leaf"] = best_time(lambda: [web.leaf(xpath=path) for path in paths], repeat) / len(paths)
+    results["leaves_for"] = best_time(lambda: web.leaves_for(paths), repeat) / len(paths)
+    results["find_n"] = best_time(lambda: [web.find_n(leaf, 10) for leaf in leaves], repeat) / len(leaves)
+    results["find_many"] = best_time(lambda: web.find_many(leaves, 10), repeat)
+
+    results["memory"] = measure_memory(kind, nodes, depth, fanout, duplication)
+    results["nodes"] = len(graph)
+    return results
+
+
+def measure_memory(kind, nodes, depth, fanout, duplication):
+    """
+    Runs `memory_of_page` in a fresh process, returning the memory used to construct a synthetic page.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--memory-of", kind, str(nodes), str(depth), str(fanout),
+               str(duplication)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1])
+
+
+def memory_of_page(kind, nodes, depth, fanout, duplication):
+    # Runs in the process started by measure_memory
+    runtime = WebLeafRuntime(text_embedding_model=stub_text_embedding_model(), subtree_cache_size=0).warmup()
+    html = generate_page(nodes, kind, depth, fanout, duplication)
+    return peak_memory(lambda: Web(html, runtime=runtime))
+
+
+def compare(results, baseline, tolerance, report=True):
+    """
+    Prints the ratio of every measurement to its baseline, returning the regressions as a dictionary of the
+    regressed measurements of each case.
+    """
+    regressions = {}
+    for case, measurements in results.items():
+        if case not in baseline:
+            print(f"{case}: no baseline")
+            continue
+        ratios = []
+        for name, value in measurements.items():
+            reference = baseline[case].get(name)
+            if name == "nodes" or not reference:
+                continue
+            ratio = value / reference
+            ratios.append(f"{name} {ratio:.2f}x")
+            if ratio > 1 + tolerance:
+                regressions.setdefault(case, []).append(
+                    f"{case} {name}: {reference:.6g} -> {value:.6g} ({ratio:.2f}x)")
+        if report:
+            print(f"{case}: " + ", ".join(ratios))
+    return regressions
+
+
+def environment():
+    return {"python": platform.python_version(), "torch": torch.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count(), "threads": torch.get_num_threads()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="The node counts of the pages, up to 500000.")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--duplication", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="The fraction a measurement can grow by before it counts as a regression.")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="The number of times the cases that regressed are measured again.")
+    parser.add_argument("--memory-of", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_of:
+        kind, nodes, depth, fanout, duplication = args.memory_of
+        print(memory_of_page(kind, int(nodes), int(depth), int(fanout), float(duplication)))
+        return
+
+    # Each page is encoded many times over, which the subtree cache would answer from memory
+    runtime = WebLeafRuntime(text_embedding_model=stub_text_embedding_model(), subtree_cache_size=0).warmup()
+    results, cases = {}, {}
+    for kind in args.kinds:
+        for nodes in args.sizes:
+            case = f"{kind}-{nodes}-d{args.depth}-f{args.fanout}-u{args.duplication}"
+            cases[case] = (runtime, kind, nodes, args.depth, args.fanout, args.duplication, args.repeat)
+            results[case] = run_case(*cases[case])
+            timings = ", ".join(f"{name} {value * 1000:.3f}ms" for name, value in results[case].items()
+                                if name not in ("memory", "nodes"))
+            print(f"{case} ({results[case]['nodes']} nodes): {timings}, "
+                  f"memory {results[case]['memory'] / 2 ** 20:.1f}MiB")
+
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], args.tolerance, report=False)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            for case in regressions:
+                print(f"Measuring {case} again")
+                remeasured = run_case(*cases[case])
+                results[case] = {name: min(value, remeasured[name]) for name, value in results[case].items()}
+            regressions = compare(results, baseline["results"], args.tolerance, report=False)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
+
+    if args.baseline:
+        if baseline["environment"] != environment():
+            print("Warning: the baseline was measured in a different environment.")
+        print()
+        compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(line for lines in regressions.values() for line in lines))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
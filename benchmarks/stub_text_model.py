@@ -0,0 +1,32 @@
+"""
+A stand-in for the sentence transformer, so that the benchmarks run offline and deterministically.
+
+Only the transformer is replaced: the pages still go through the real TextEmbeddingModel, so the benchmarks time
+the sentence splitting, the deduplication of the texts and the text embedding cache.
+"""
+from webleaf.model.TextModel import TextEmbeddingModel, TEXT_DIMS
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+import hashlib
+import numpy as np
+
+
+class StubSentenceTransformer:
+    """
+    Maps every sentence to a fixed random unit vector derived from its hash, without any model or network access.
+    """
+    def encode(self, sentences):
+        return np.stack([embed_sentence(sentence) for sentence in sentences]).reshape(-1, TEXT_DIMS)
+
+
+def embed_sentence(sentence):
+    seed = int.from_bytes(hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(TEXT_DIMS).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def stub_text_embedding_model(**kwargs):
+    """
+    Returns a TextEmbeddingModel running the stub transformer and an untrained Punkt tokenizer, which needs no
+    download. The keyword arguments are passed on to TextEmbeddingModel.
+    """
+    return TextEmbeddingModel(model=StubSentenceTransformer(), tokenizer=PunktSentenceTokenizer(), **kwargs)
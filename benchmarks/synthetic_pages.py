@@ -0,0 +1,160 @@
+"""
+Generates synthetic product and listing pages of any size, for the benchmarks.
+
+- product: an irregular tree of sections, as found on a product page.
+- listing: a grid of product cards sharing the same structure, as found on a search or category page.
+
+The pages are deterministic for a given seed. `duplication` is the fraction of the texts drawn from a small pool
+of common phrases ("Add to cart", "Free shipping", ...), the other texts being unique.
+
+Usage:
+    python benchmarks/synthetic_pages.py --nodes 10000 --kind listing > page.html
+"""
+from html import escape
+import argparse
+import random
+
+KINDS = ("product", "listing")
+# The tags of the elements that have children
+CONTAINER_TAGS = ["div", "div", "div", "section", "article", "ul"]
+# The tags of the elements without children
+LEAF_TAGS = ["span", "span", "p", "a", "img", "h3", "button"]
+# The texts shared by many elements of a page
+COMMON_TEXTS = ["Add to cart", "Free shipping", "In stock", "Buy now", "Compare", "Reviews", "Share",
+                "Sold by WebLeaf", "Only a few left.", "Price", "Color", "Size", "Home", "Next", "Previous",
+                "Sign in", "Wishlist", "Details", "Returns within days.", "Customer service"]
+WORDS = ["deluxe", "compact", "wireless", "organic", "classic", "portable", "smart", "premium", "steel", "cotton",
+         "lamp", "chair", "headphones", "kettle", "backpack", "jacket", "camera", "watch", "bottle", "desk"]
+
+
+class TextSource:
+    """
+    Draws the texts of the elements, a `duplication` fraction of them from COMMON_TEXTS.
+    """
+    def __init__(self, rng, duplication):
+        self.rng = rng
+        self.duplication = duplication
+        self.count = 0
+
+    def __call__(self):
+        if self.rng.random() < self.duplication:
+            return self.rng.choice(COMMON_TEXTS)
+        self.count += 1
+        words = " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(2, 6)))
+        return f"Item {self.count} {words}."
+
+
+def random_shape(rng, nodes, depth, fanout):
+    """
+    Returns the children of each node of a random tree of `nodes` nodes, node 0 being the root.
+    """
+    children = [[]]
+    frontier = [(0, 0)]
+    while len(children) < nodes:
+        if not frontier:
+            # Every branch ended early, start a new section under the root
+            frontier.append((0, 0))
+        parent, level = frontier.pop(rng.randrange(len(frontier)))
+        if level >= depth:
+            continue
+        for _ in range(rng.randint(1, fanout)):
+            if len(children) == nodes:
+                break
+            children[parent].append(len(children))
+            children.append([])
+            if rng.random() < 0.6:
+                frontier.append((len(children) - 1, level + 1))
+    return children
+
+
+def assign_tags(children, rng):
+    """
+    Picks the tag of each node of a tree shape, the elements with children getting a container tag.
+    """
+    return [rng.choice(CONTAINER_TAGS) if node_children else rng.choice(LEAF_TAGS) for node_children in children]
+
+
+def render(children, tags, texts, parts):
+    """
+    Renders a tree shape as HTML into `parts`, without recursion so that deep pages can be rendered.
+    """
+    stack = [(0, None)]
+    while stack:
+        node, closing = stack.pop()
+        if node is None:
+            parts.append(closing)
+        elif children[node]:
+            parts.append(f"<{tags[node]}>")
+            stack.append((None, f"</{tags[node]}>"))
+            for child in reversed(children[node]):
+                if tags[node] == "ul":
+                    # The children of a list are wrapped in list items
+                    stack.extend([(None, "</li>"), (child, None), (None, "<li>")])
+                else:
+                    stack.append((child, None))
+        elif tags[node] == "img":
+            parts.append(f'<img alt="{escape(texts())}">')
+        else:
+            parts.append(f"<{tags[node]}>{escape(texts())}</{tags[node]}>")
+    return parts
+
+
+def generate_page(nodes: int = 1000, kind: str = "product", depth: int = 12, fanout: int = 6,
+                  duplication: float = 0.3, seed: int = 0) -> str:
+    """
+    Generates a synthetic HTML page.
+
+    Parameters:
+    -----------
+    nodes : int, optional
+        The approximate number of elements of the page body. (default is 1000)
+    kind : str, optional
+        Either "product" or "listing". (default is "product")
+    depth : int, optional
+        The maximum nesting depth of the generated elements. (default is 12)
+    fanout : int, optional
+        The maximum number of children of an element. (default is 6)
+    duplication : float, optional
+        The fraction of the texts drawn from a pool of common phrases. (default is 0.3)
+    seed : int, optional
+        The seed of the random generator. (default is 0)
+
+    Returns:
+    --------
+    str
+        The HTML of the page.
+    """
+    assert kind in KINDS, f"Unknown page kind [{kind}], expected one of {KINDS}."
+    rng = random.Random(seed)
+    texts = TextSource(rng, duplication)
+    parts = ["<html><head><title>", escape(texts()), "</title></head><body>"]
+    if kind == "product":
+        shape = random_shape(rng, nodes, depth, fanout)
+        render(shape, assign_tags(shape, rng), texts, parts)
+    else:
+        # Every card has the same structure, only its texts change
+        card = random_shape(rng, rng.randint(6, 14), min(depth, 4), min(fanout, 4))
+        tags = assign_tags(card, rng)
+        tags[0] = "article"
+        parts.append("<div>")
+        for _ in range(max(1, nodes // len(card))):
+            render(card, tags, texts, parts)
+        parts.append("</div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--kind", choices=KINDS, default="product")
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--duplication", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate_page(args.nodes, args.kind, args.depth, args.fanout, args.duplication, args.seed))
+
+
+if __name__ == "__main__":
+    main()
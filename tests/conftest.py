@@ -0,0 +1,12 @@
+from webleaf.model.TextModel import load_sentence_tokenizer, load_sentence_transformer
+import pytest
+
+
+@pytest.fixture(scope="session")
+def text_assets():
+    # Downloads the text model and the Punkt tokenizer once per session when they are not installed yet, so that
+    # no test depends on another one having run first
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("WEBLEAF_DOWNLOAD", "1")
+        load_sentence_tokenizer()
+        load_sentence_transformer()
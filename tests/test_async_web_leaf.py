@@ -0,0 +1,31 @@
+from webleaf import AsyncWebLeaf, Web
+import asyncio
+import os
+import pytest
+
+dirname = os.path.dirname(__file__)
+
+EXAMPLE_PATH = os.path.join(dirname, "example.html")
+
+example = open(EXAMPLE_PATH).read()
+
+# Every test encodes pages with the text model
+pytestmark = pytest.mark.usefixtures("text_assets")
+
+
+def test_async_encode_coalesces_and_deduplicates():
+    htmls = [example.replace("June 10", f"June {day}") for day in range(1, 6)]
+
+    async def encode_all():
+        async with AsyncWebLeaf(window=0.05) as service:
+            webs = await asyncio.gather(*[service.encode(html) for html in htmls + htmls])
+            return webs, service.metrics
+
+    webs, metrics = asyncio.run(encode_all())
+    assert metrics["requests"] == 10
+    assert metrics["deduplicated"] == 5
+    assert metrics["batches"] == 1
+    assert metrics["queue_depth"] == 0
+    assert all(webs[i] is webs[i + 5] for i in range(5))
+    for web, html in zip(webs, htmls):
+        assert (web.features - Web(html).features).abs().max() < 1e-5
@@ -0,0 +1,37 @@
+from webleaf import Leaf
+from webleaf.Leaf import LeafMapping, LeafSequence
+import numpy as np
+
+
+def test_leaf_is_a_view():
+    matrix = np.arange(12, dtype=np.float32).reshape(3, 4)
+    leaf = Leaf(matrix, 1)
+    assert np.shares_memory(np.asarray(leaf), matrix)
+    assert (np.asarray(leaf) == [4, 5, 6, 7]).all()
+    assert leaf
+
+
+def test_leaf_distances():
+    matrix = np.array([[1, 0, 0], [0, 1, 0], [2, 0, 0]], dtype=np.float32)
+    leaf = Leaf(matrix, 0)
+    assert leaf.mdist(Leaf(matrix, 1)) == 2.0
+    assert abs(leaf.similarity(Leaf(matrix, 2)) - 1.0) < 1e-6
+    assert abs(leaf.similarity(Leaf(matrix, 1))) < 1e-6
+
+
+def test_leaf_from_vector():
+    leaf = Leaf(np.ones(32, dtype=np.float32))
+    assert len(leaf) == 32
+    assert leaf.mdist(np.zeros(32)) == 32.0
+
+
+def test_leaf_sequence_and_mapping():
+    matrix = np.arange(12, dtype=np.float32).reshape(3, 4)
+    leaves = LeafSequence(matrix)
+    assert len(leaves) == 3
+    assert (leaves[-1].vector == matrix[2]).all()
+    assert [leaf.index for leaf in leaves[1:]] == [1, 2]
+    path_leaves = LeafMapping(matrix, {"/html": 0, "/html/body": 1})
+    assert "/html/body" in path_leaves
+    assert path_leaves["/html/body"].index == 1
+    assert list(path_leaves) == ["/html", "/html/body"]
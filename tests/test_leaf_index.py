@@ -0,0 +1,72 @@
+from webleaf import LeafIndex
+import numpy as np
+
+random = np.random.default_rng(0)
+
+
+def make_document(n=200):
+    features = random.standard_normal((n, 32)).astype(np.float32)
+    paths = [f"/html/body/div[{i + 1}]" for i in range(n)]
+    return features, paths
+
+
+def test_exact_search():
+    index = LeafIndex()
+    features, paths = make_document()
+    index.add("page-1", features, paths, metadata={"url": "https://example.com"})
+    index.add("page-2", *make_document())
+    doc_id, path, distance = index.search(features[42], n=3, exact=True)[0]
+    assert (doc_id, path) == ("page-1", "/html/body/div[43]")
+    assert distance < 1e-5
+    assert index.metadata("page-1") == {"url": "https://example.com"}
+
+
+def test_approximate_search():
+    index = LeafIndex()
+    documents = [make_document() for _ in range(10)]
+    for i, (features, paths) in enumerate(documents):
+        index.add(i, features, paths)
+    index.build(n_lists=8)
+    features, paths = documents[3]
+    results = index.search(features[7], n=5, n_probe=2)
+    assert results[0][:2] == (3, paths[7])
+    assert [r[2] for r in results] == sorted(r[2] for r in results)
+
+
+def test_remove():
+    index = LeafIndex(metric="cosine")
+    features, paths = make_document()
+    index.add("old", features, paths)
+    index.add("new", *make_document())
+    index.remove("old")
+    assert len(index) == 200
+    assert all(doc_id == "new" for doc_id, _, _ in index.search(features[0], n=10))
+
+
+def test_save_load(tmp_path):
+    index = LeafIndex()
+    features, paths = make_document()
+    index.add("page", features, paths, metadata={"label": "price"})
+    index.add("gone", *make_document())
+    index.remove("gone")
+    index.build(n_lists=4)
+    index.save(str(tmp_path))
+    loaded = LeafIndex.load(str(tmp_path))
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.doc_ids == ["page"]
+    assert loaded.metadata("page") == {"label": "price"}
+    assert loaded.search(features[5], n=1, exact=True)[0][:2] == ("page", paths[5])
+    loaded.add("more", *make_document())
+    assert len(loaded) == 400
+
+
+def test_remove_between_adds():
+    index = LeafIndex()
+    documents = [make_document(50) for _ in range(3)]
+    index.add("page-1", *documents[0])
+    index.add("page-2", *documents[1])
+    index.remove("page-1")
+    index.add("page-3", *documents[2])
+    assert len(index) == 100
+    assert index.search(documents[2][0][7], n=1, exact=True)[0][:2] == ("page-3", "/html/body/div[8]")
+    assert all(doc_id != "page-1" for doc_id, _, _ in index.search(documents[0][0][7], n=100, exact=True))
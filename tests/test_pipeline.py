@@ -0,0 +1,37 @@
+from webleaf import Web, encode_stream
+import os
+import pytest
+
+dirname = os.path.dirname(__file__)
+
+EXAMPLE_PATH = os.path.join(dirname, "example.html")
+
+example = open(EXAMPLE_PATH).read()
+
+# Every test encodes pages with the text model
+pytestmark = pytest.mark.usefixtures("text_assets")
+
+htmls = [example.replace("June 10", f"June {day}") for day in range(1, 11)]
+
+
+def test_encode_stream_ordered():
+    expected = Web.from_many(htmls)
+    webs = list(encode_stream(htmls, workers=2, batch_size=3))
+    assert [web.html for web in webs] == htmls
+    for web, reference in zip(webs, expected):
+        assert (web.features - reference.features).abs().max() < 1e-5
+        assert web.find(reference.leaf(xpath=".//h3")) == reference.find(reference.leaf(xpath=".//h3"))
+
+
+def test_encode_stream_unordered():
+    webs = list(encode_stream(iter(htmls), workers=0, batch_size=4, ordered=False))
+    assert sorted(web.html for web in webs) == sorted(htmls)
+    assert all(web.encoded for web in webs)
+
+
+def test_encode_stream_formatting_tags():
+    html = "<html><body><p><b><span>Sale</span></b> today</p><p><strong><a>Shop</a></strong></p></body></html>"
+    web, = encode_stream([html], workers=0)
+    reference = Web(html)
+    assert web.leaf(xpath="//span").index == reference.leaf(xpath="//span").index
+    assert web.leaves_for(["//span", "//a"])[1] == reference.leaves_for(["//span", "//a"])[1]
@@ -0,0 +1,29 @@
+from webleaf import WebLeafRuntime
+from webleaf.Profiler import collect, current_stats, stage
+
+
+def test_disabled_profiling_collects_nothing():
+    with collect(WebLeafRuntime()) as stats:
+        with stage("parse"):
+            pass
+        assert stats is None
+        assert current_stats() is None
+
+
+def test_nested_collections_report_once():
+    reported = []
+    runtime = WebLeafRuntime(stats_sink=reported.append)
+    with collect(runtime, pages=2) as stats:
+        with stage("parse"):
+            pass
+        with collect(runtime) as nested:
+            assert nested is stats
+            with stage("parse"):
+                pass
+            with stage("gcn"):
+                pass
+    assert reported == [stats]
+    assert stats.pages == 2
+    assert list(stats.stages) == ["parse", "gcn"]
+    assert stats.time >= sum(stats.stages.values())
+    assert current_stats() is None
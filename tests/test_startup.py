@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+dirname = os.path.dirname(__file__)
+
+EXAMPLE_PATH = os.path.join(dirname, "example.html")
+
+HEAVY_MODULES = ["nltk", "sentence_transformers", "transformers", "torch_geometric"]
+
+
+def run_python(code, **env):
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(dirname), **env)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=environment, check=True)
+    return result.stdout.strip()
+
+
+def test_import_is_lazy():
+    loaded = run_python(f"import sys, webleaf; print([m for m in {HEAVY_MODULES} if m in sys.modules])")
+    assert loaded == "[]"
+
+
+def test_import_time():
+    seconds = run_python("import time; import torch; start = time.perf_counter(); import webleaf; "
+                         "print(time.perf_counter() - start)")
+    assert float(seconds) < 0.5
+
+
+def test_first_web_offline(text_assets):
+    # A fresh process starts from the installed models without downloading anything, see benchmarks/cold_start.py
+    # for its timing
+    root = run_python(f"from webleaf import Web; web = Web(open({EXAMPLE_PATH!r}).read()); print(web.paths[0])",
+                      WEBLEAF_DOWNLOAD="0")
+    assert root == "/html"
@@ -0,0 +1,54 @@
+from webleaf.model.SubtreeCache import SubtreeFeatureCache
+from webleaf.model.WebGraphAutoEncoder import build_graph
+from lxml import etree
+import torch
+
+CARD = "<article><h3>Lamp</h3><p>Add to cart</p><span>In stock</span></article>"
+LISTING = f"<html><body><div>{CARD * 3}</div><footer><a>Home</a><a>Returns</a></footer></body></html>"
+
+
+def fake_features(graph, rows):
+    # One distinct row per (tag, text), like the input features of the encoder
+    return torch.tensor([[float(graph.tag_ids[row]), float(len(graph.texts[row]))] for row in rows]).reshape(-1, 2)
+
+
+def encode(cache, graph):
+    lookup = cache.lookup([graph])
+    input_features = torch.full((len(graph), 2), -1.0)
+    input_features[lookup.missing] = fake_features(graph, lookup.missing)
+    cache.resolve(lookup, input_features)
+    return lookup, input_features
+
+
+def test_repeated_subtrees_share_a_hash():
+    graph = build_graph(etree.ElementTree(etree.HTML(LISTING)))
+    hashes, sizes = graph.subtrees()
+    cards = [node for node, tag in enumerate(graph.tags) if tag == "article"]
+    assert len(cards) == 3
+    assert len({hashes[node] for node in cards}) == 1
+    assert [sizes[node] for node in cards] == [4, 4, 4]
+    assert sizes[0] == len(graph)
+
+
+def test_repeated_subtrees_reuse_features():
+    graph = build_graph(etree.ElementTree(etree.HTML(LISTING)))
+    cache = SubtreeFeatureCache()
+    lookup, input_features = encode(cache, graph)
+    assert lookup.hits == 2
+    assert lookup.reused == 8
+    assert torch.equal(input_features, fake_features(graph, range(len(graph))))
+
+    # The second time around the whole page is a single cached subtree
+    lookup, input_features = encode(cache, graph)
+    assert lookup.hits == 1
+    assert len(lookup.missing) == 0
+    assert torch.equal(input_features, fake_features(graph, range(len(graph))))
+
+
+def test_cache_evicts_by_rows():
+    graph = build_graph(etree.ElementTree(etree.HTML(LISTING)))
+    cache = SubtreeFeatureCache(capacity=4)
+    encode(cache, graph)
+    assert cache.rows <= 4
+    lookup, input_features = encode(cache, graph)
+    assert torch.equal(input_features, fake_features(graph, range(len(graph))))
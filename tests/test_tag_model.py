@@ -0,0 +1,20 @@
+from webleaf.model.TagModel import TagEmbeddingModel, html_tags, TAG_DIMS
+import torch
+
+
+def test_tag_table_matches_model():
+    model = TagEmbeddingModel()
+    with torch.no_grad():
+        expected = model.embedding_model(torch.arange(len(html_tags)))
+    assert torch.allclose(model.table, expected)
+    assert not model.table.requires_grad
+
+
+def test_tag_embedding_by_id():
+    model = TagEmbeddingModel()
+    tags = ["div", "p", "a", "div"]
+    by_name = model.get_tag_embedding(tags)
+    out = torch.zeros((len(tags), 2 * TAG_DIMS))
+    model.get_tag_embedding_by_id([html_tags.index(tag) for tag in tags], out=out[:, TAG_DIMS:])
+    assert torch.equal(out[:, TAG_DIMS:], by_name)
+    assert not out[:, :TAG_DIMS].any()
@@ -0,0 +1,48 @@
+from webleaf.model.TextCache import TextEmbeddingCache
+import numpy as np
+
+
+def test_cache_hit_and_miss():
+    cache = TextEmbeddingCache(4, capacity=2)
+    assert cache.get("Add to cart") is None
+    cache.put(["Add to cart"], np.ones((1, 4)))
+    assert (cache.get("Add to cart") == 1).all()
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_lru_eviction():
+    cache = TextEmbeddingCache(4, capacity=2)
+    cache.put(["a", "b"], np.zeros((2, 4)))
+    cache.get("a")
+    cache.put(["c"], np.zeros((1, 4)))
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_cache_persistence(tmp_path):
+    path = str(tmp_path / "text_cache")
+    cache = TextEmbeddingCache(4, path=path)
+    cache.put(["Home", "Shop"], np.arange(8).reshape(2, 4))
+    reopened = TextEmbeddingCache(4, capacity=0, path=path)
+    assert (reopened.get("Shop") == [4, 5, 6, 7]).all()
+    assert reopened.get("Cart") is None
+
+
+def test_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "text_cache")
+    writer = TextEmbeddingCache(4, path=path)
+    reader = TextEmbeddingCache(4, path=path)
+    writer.put(["Footer"], np.ones((1, 4)))
+    assert (reader.get("Footer") == 1).all()
+
+
+def test_cache_refresh_once_per_batch(tmp_path):
+    path = str(tmp_path / "text_cache")
+    writer = TextEmbeddingCache(4, path=path)
+    reader = TextEmbeddingCache(4, path=path)
+    writer.put(["Footer"], np.ones((1, 4)))
+    assert reader.get("Footer", refresh=False) is None
+    reader.refresh()
+    assert (reader.get("Footer", refresh=False) == 1).all()
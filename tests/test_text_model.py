@@ -0,0 +1,66 @@
+from webleaf.model.TextModel import TextEmbeddingModel, first_sentence, TEXT_DIMS
+from webleaf.model.WebGraphAutoEncoder import build_graph, clean_text
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+from lxml import etree
+import numpy as np
+import os
+import random
+import re
+
+dirname = os.path.dirname(__file__)
+
+EXAMPLE_PATH = os.path.join(dirname, "example.html")
+
+example = open(EXAMPLE_PATH).read()
+
+TEXTS = [
+    "", " ", "Hello", "Hello world  ", "Hello. World", "Dr. Smith went home. Then he slept.", "Is it? Yes!",
+    "e.g. this one", "U.S.A. is big. Really.", "...", ". . . done", "'Quoted.' Next one", "(Paren.) Next",
+    "Wait!!! What?", "No break here, just commas; and colons: ok", "Ends with a period.", "A. B. C. D.",
+]
+
+
+def reference_clean_text(text):
+    if not text:
+        return
+    return ' '.join(re.sub(r'[^a-zA-Z\s.,!?\'\";:]', '', text).split())
+
+
+def test_clean_text_matches_reference():
+    generator = random.Random(0)
+    alphabet = "abcXYZ .,!?;:'\"\t\né中0123-_/()"
+    for _ in range(2000):
+        text = "".join(generator.choice(alphabet) for _ in range(generator.randint(0, 40)))
+        assert clean_text(text) == reference_clean_text(text)
+
+
+def test_first_sentence_matches_sent_tokenize():
+    texts = TEXTS + build_graph(etree.ElementTree(etree.HTML(example))).texts
+    generator = random.Random(0)
+    words = ["Mr.", "Inc.", "the", "Price", "is", "10.", "ok", "No.", "e.g.", "It", "?", "!", "...", "end."]
+    texts += [" ".join(generator.choice(words) for _ in range(generator.randint(1, 12))) for _ in range(500)]
+    # The trained tokenizer knows the abbreviations of the example page, the untrained one knows none
+    for tokenizer in [PunktSentenceTokenizer(), PunktSentenceTokenizer(" ".join(texts))]:
+        for text in texts:
+            expected = tokenizer.tokenize(text)
+            assert first_sentence(tokenizer, text) == (expected[0] if expected else "")
+
+
+class LengthEncoder:
+    # Embeds every sentence as its length, recording the sentences it is given
+    def __init__(self):
+        self.sentences = []
+
+    def encode(self, sentences):
+        self.sentences.extend(sentences)
+        return np.array([[len(sentence)] * TEXT_DIMS for sentence in sentences], dtype=np.float32)
+
+
+def test_injected_model_embeds_each_sentence_once():
+    encoder = LengthEncoder()
+    model = TextEmbeddingModel(model=encoder, tokenizer=PunktSentenceTokenizer())
+    texts = ["Add to cart", "In stock. Ships today", "", "Add to cart", "In stock."]
+    for _ in range(2):
+        embeddings = model.get_text_embeddings(texts)
+        assert encoder.sentences == ["", "Add to cart", "In stock."]
+        assert embeddings[:, 0].tolist() == [11, 9, 0, 11, 9]
@@ -1,5 +1,12 @@
-from webleaf import Web
+from webleaf import Leaf, Web, WebLeafRuntime
+from webleaf.WebStore import write_page
+from webleaf.model.WebGraphAutoEncoder import build_graph, graph_elements
+from lxml import etree
+import numpy as np
 import os
+import pytest
+import threading
+import torch
 
 dirname = os.path.dirname(__file__)
 
@@ -7,6 +14,9 @@ EXAMPLE_PATH = os.path.join(dirname, "example.html")
 
 example = open(EXAMPLE_PATH).read()
 
+# Every test encodes pages with the text model
+pytestmark = pytest.mark.usefixtures("text_assets")
+
 
 def test_leaf_from_xpath():
     web = Web(example)
@@ -74,3 +84,145 @@ def test_custom_tags():
     web = Web(example)
     custom_tag_button = web.leaf(xpath="/html/body/div/div/div[4]/customtag/button")
     assert custom_tag_button
+
+
+def test_from_many():
+    single = Web(example)
+    webs = Web.from_many([example, example, example], batch_size=2)
+    assert len(webs) == 3
+    for web in webs:
+        assert web.paths == single.paths
+        assert (web.features - single.features).abs().max() < 1e-4
+
+
+def test_update():
+    web = Web(example)
+    changed = example.replace("June 10", "July 10")
+    updated = web.update(changed)
+    assert updated == ["/html/body/div/div/div[1]/div[2]/span"]
+    fresh = Web(changed)
+    assert web.paths == fresh.paths
+    assert (web.features - fresh.features).abs().max() < 1e-4
+
+
+def test_leaf_find_many():
+    web = Web(example)
+    description = web.leaf(xpath="/html/body/div[1]/div/div[1]/div[1]/p")
+    title = web.leaf(xpath="/html/body/div/div/div[3]/h3")
+    found = web.find_many([description, title], 2)
+    assert found[0] == web.find_n(description, 2)
+    assert found[1][0] == "/html/body/div/div/div[3]/h3"
+
+
+def test_paths_match_tree():
+    web = Web(example)
+    for path in web.paths:
+        assert web.tree.getpath(web.tree.xpath(path)[0]) == path
+
+
+def test_runtime_loads_once():
+    runtime = WebLeafRuntime()
+    assert not runtime.loaded
+    webs = []
+    threads = [threading.Thread(target=lambda: webs.append(Web(example, runtime=runtime))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert runtime.loaded
+    assert len(webs) == 4
+    assert len({id(web.runtime.encoder) for web in webs}) == 1
+
+
+def test_streaming_matches_full():
+    web = Web(example)
+    streamed = Web(example, max_memory=64_000)
+    assert streamed.paths == web.paths
+    assert (streamed.features - web.features).abs().max() < 1e-4
+
+
+def test_lazy_encodes_on_first_query():
+    web = Web(example, lazy=True)
+    assert not web.encoded
+    assert len(web.paths) == len(web.graph.texts)
+    leaf = web.leaf(xpath=".//p")
+    assert web.encoded
+    assert (web.features == Web(example).features).all()
+    assert web.find(leaf) == web.paths[leaf.index]
+
+
+def test_reduced_precision():
+    runtime = WebLeafRuntime(gcn_precision="bfloat16", output_precision="float16")
+    web = Web(example, runtime=runtime)
+    reference = Web(example)
+    assert web.features.dtype == torch.float16
+    assert torch.allclose(web.features.float(), reference.features, atol=1e-2)
+    leaf = reference.leaf(xpath=".//h3")
+    assert web.find(leaf) == reference.find(leaf)
+
+
+def test_profiling():
+    reported = []
+    runtime = WebLeafRuntime(stats_sink=reported.append)
+    web = Web(example, runtime=runtime)
+    assert reported == [web.stats]
+    assert {"parse", "traverse", "gcn"} <= set(web.stats.stages)
+    assert web.stats.nodes == len(web.paths)
+    assert 0 < web.stats.unique_text_ratio <= 1
+    assert Web(example).stats is None
+
+
+def test_repeated_page_reuses_subtrees():
+    runtime = WebLeafRuntime(profile=True)
+    first = Web(example, runtime=runtime)
+    second = Web(example, runtime=runtime)
+    assert second.stats.reused_nodes == len(second.paths)
+    assert second.stats.texts == 0
+    assert torch.equal(first.features, second.features)
+    uncached = WebLeafRuntime(subtree_cache_size=0)
+    assert torch.equal(runtime.encoder.embed_graphs([first.graph]), uncached.encoder.embed_graphs([first.graph]))
+
+
+def test_leaves_for():
+    web = Web(example)
+    xpaths = ["/html/body/div[1]/div/div[1]/div[1]/p", "/html/body/div[1]/div/div[1]/div[2]/a"]
+    leaves = [web.leaf(xpath=xpath) for xpath in xpaths]
+    matrix, paths = web.leaves_for(xpaths)
+    assert paths == [web.paths[leaf.index] for leaf in leaves]
+    assert (matrix == np.stack([leaf.vector for leaf in leaves])).all()
+
+    css = "div.card:nth-child(1) > div:nth-child(2) > p:nth-child(1)"
+    matrix, paths = web.leaves_for([css, "div.missing"], css=True, strict=False)
+    assert paths == [web.paths[leaves[0].index], None]
+    assert np.isnan(matrix[1]).all()
+
+
+def test_graph_elements_follow_graph_rows():
+    pages = [example, "<html><body><!-- menu --><div><div><p>One <b>bold</b> word</p></div></div>"
+                      "<div><p>A</p><p>B</p></div><script>var x;</script><?php echo 1; ?></body></html>"]
+    for html in pages:
+        tree = etree.ElementTree(etree.HTML(html))
+        graph = build_graph(tree)
+        assert [tree.getpath(element) for element in graph_elements(tree)] == graph.paths
+
+
+def test_traced_gcn_matches_eager():
+    traced = Web(example, runtime=WebLeafRuntime())
+    eager = Web(example, runtime=WebLeafRuntime(gcn_backend="eager"))
+    assert torch.allclose(traced.features, eager.features, atol=1e-5)
+
+
+def test_find_n_ranks_ties_in_document_order(tmp_path):
+    # Repeated tiles have identical features, every tile is tied with the others
+    matrix = np.repeat(np.eye(4, 32, dtype=np.float32), 50, axis=0)
+    paths = [f"/html/body/div[{i + 1}]" for i in range(len(matrix))]
+    with open(tmp_path / "tiles.wleaf", "wb") as file:
+        write_page(file, matrix, np.zeros((2, 0), dtype=np.int64), paths)
+    web = Web.load(tmp_path / "tiles.wleaf")
+    leaf = Leaf(web.matrix, 120)
+    ranking = web.find_n(leaf, len(paths))
+    assert ranking[:50] == paths[100:150]
+    for n in [1, 2, 10, 50, 60]:
+        assert web.find_n(leaf, n) == ranking[:n]
+    assert web.find_n(leaf, 0) == []
+    assert web.find_many([leaf, leaf], 0) == [[], []]
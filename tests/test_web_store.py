@@ -0,0 +1,61 @@
+from webleaf import Web, WebStore
+import numpy as np
+import os
+import pytest
+
+dirname = os.path.dirname(__file__)
+
+EXAMPLE_PATH = os.path.join(dirname, "example.html")
+
+example = open(EXAMPLE_PATH).read()
+
+# Every test encodes pages with the text model
+pytestmark = pytest.mark.usefixtures("text_assets")
+
+
+def test_save_load(tmp_path):
+    web = Web(example)
+    web.save(tmp_path / "page.wleaf")
+    loaded = Web.load(tmp_path / "page.wleaf")
+    assert (loaded.matrix == web.matrix).all()
+    assert loaded.paths == web.paths
+    assert (loaded.edge_index == web.graph.edge_index).all()
+    leaf = web.leaf(xpath=".//h3")
+    assert loaded.find(leaf) == web.find(leaf)
+    assert loaded.leaf(xpath=".//h3").index == leaf.index
+
+
+def test_save_half_precision_without_html(tmp_path):
+    web = Web(example)
+    web.save(tmp_path / "page.wleaf", dtype="float16", include_html=False)
+    loaded = Web.load(tmp_path / "page.wleaf")
+    assert loaded.html is None
+    assert loaded.matrix.dtype == np.float16
+    assert np.allclose(loaded.matrix, web.matrix, atol=1e-2)
+
+
+def test_pack_shards(tmp_path):
+    webs = Web.from_many([example] * 5)
+    store = WebStore.pack(webs, tmp_path / "store", shard_pages=2)
+    assert len(store.shards) == 3
+    assert len(WebStore(tmp_path / "store")) == 5
+    for web, loaded in zip(webs, store):
+        assert (loaded.matrix == web.matrix).all()
+
+
+def test_save_load_formatting_tags(tmp_path):
+    web = Web("<html><body><p><b><span>Sale</span></b> today</p><p><i>New</i> <em><a>Shop</a></em></p></body></html>")
+    web.save(tmp_path / "page.wleaf")
+    loaded = Web.load(tmp_path / "page.wleaf")
+    assert loaded.leaf(xpath="//span").index == web.leaf(xpath="//span").index
+    matrix, paths = loaded.leaves_for(["//span", "//a"], strict=False)
+    assert paths == web.leaves_for(["//span", "//a"])[1]
+    assert None not in paths
+
+
+def test_update_loaded_page(tmp_path):
+    Web(example).save(tmp_path / "page.wleaf")
+    loaded = Web.load(tmp_path / "page.wleaf")
+    changed = example.replace("June 10", "July 10")
+    assert loaded.update(changed) == ["/html/body/div/div/div[1]/div[2]/span"]
+    assert (loaded.features - Web(changed).features).abs().max() < 1e-4
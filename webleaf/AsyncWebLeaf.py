@@ -0,0 +1,192 @@
+from .Profiler import collect
+from .Runtime import get_default_runtime
+from .Web import Web
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import time
+
+# How long, in seconds, a request waits for other requests to be encoded with
+COALESCE_WINDOW = 0.005
+# The maximum number of pages encoded together
+MAX_BATCH_SIZE = 32
+
+
+class AsyncWebLeaf:
+    """
+    An asyncio front end to WebLeaf, encoding pages without blocking the event loop.
+
+    The requests made within a short window of each other are coalesced into a single batch, which is parsed
+    and encoded in a worker thread with one text embedding call and one GCN pass. Requests for an HTML document
+    that is already being encoded wait for that encoding instead of starting a new one, and receive the same
+    Web object.
+
+    Attributes:
+    -----------
+    runtime : WebLeafRuntime
+        The runtime holding the models used to encode the pages.
+    window : float
+        How long, in seconds, a request waits for other requests to be encoded with.
+    max_batch_size : int
+        The maximum number of pages encoded together, a full batch is encoded without waiting for the window.
+    """
+    def __init__(self, runtime=None, window: float = COALESCE_WINDOW, max_batch_size: int = MAX_BATCH_SIZE,
+                 executor=None):
+        """
+        Initializes the service, without loading any model.
+
+        Parameters:
+        -----------
+        runtime : WebLeafRuntime, optional
+            The runtime holding the models, the shared default runtime is used when omitted. (default is None)
+        window : float, optional
+            How long, in seconds, a request waits for other requests to be encoded with. (default is
+            COALESCE_WINDOW)
+        max_batch_size : int, optional
+            The maximum number of pages encoded together. (default is MAX_BATCH_SIZE)
+        executor : concurrent.futures.Executor, optional
+            The executor the batches are encoded in, a single worker thread is used when omitted.
+            (default is None)
+        """
+        assert window >= 0, "The coalescing window can not be negative."
+        assert max_batch_size > 0, "The maximum batch size must be positive."
+        self.runtime = runtime or get_default_runtime()
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._pending = []
+        self._in_flight = {}
+        self._timer = None
+        self._tasks = set()
+        self._requests = 0
+        self._deduplicated = 0
+        self._batches = 0
+        self._batched_pages = 0
+        self._largest_batch = 0
+        self._latency = 0.0
+        self._max_latency = 0.0
+        self._answered = 0
+
+    async def encode(self, html: str) -> Web:
+        """
+        Parses and encodes an HTML document.
+
+        Parameters:
+        -----------
+        html : str
+            The HTML content to be parsed and encoded.
+
+        Returns:
+        --------
+        Web
+            The encoded page, shared with the concurrent requests for the same document.
+        """
+        start = time.perf_counter()
+        self._requests += 1
+        key = hashlib.blake2b(html.encode("utf-8"), digest_size=16).digest()
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            self._pending.append((key, html, future))
+            self._schedule()
+        else:
+            self._deduplicated += 1
+
+        try:
+            # Shielded, so that a cancelled request does not cancel the others waiting on the same document
+            return await asyncio.shield(future)
+        finally:
+            latency = time.perf_counter() - start
+            self._answered += 1
+            self._latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    @property
+    def metrics(self):
+        """
+        A dictionary describing the activity of the service:
+
+        - queue_depth: the requests waiting for their batch to start.
+        - in_flight: the distinct documents waiting or being encoded.
+        - requests: the requests received.
+        - deduplicated: the requests answered by the encoding of an identical document.
+        - batches: the batches encoded.
+        - mean_batch_size / max_batch_size: the number of documents per batch.
+        - mean_latency / max_latency: the time, in seconds, between a request and its answer.
+        """
+        return {
+            "queue_depth": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "requests": self._requests,
+            "deduplicated": self._deduplicated,
+            "batches": self._batches,
+            "mean_batch_size": self._batched_pages / self._batches if self._batches else 0.0,
+            "max_batch_size": self._largest_batch,
+            "mean_latency": self._latency / self._answered if self._answered else 0.0,
+            "max_latency": self._max_latency,
+        }
+
+    def close(self):
+        """
+        Shuts down the worker thread of the service, when it owns one.
+        """
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _schedule(self):
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+            self._batches += 1
+            self._batched_pages += len(batch)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            # The event loop only keeps weak references to its tasks
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="webleaf")
+        htmls = [html for _, html, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode_batch, htmls)
+        except Exception as exception:
+            results = [exception] * len(batch)
+        for (key, _, future), result in zip(batch, results):
+            del self._in_flight[key]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _encode_batch(self, htmls):
+        # Runs in the worker thread, a document that can not be parsed only fails its own requests
+        with collect(self.runtime, pages=len(htmls)):
+            results = []
+            for html in htmls:
+                try:
+                    results.append(Web(html, runtime=self.runtime, lazy=True))
+                except Exception as exception:
+                    results.append(exception)
+            webs = [result for result in results if isinstance(result, Web)]
+            if webs:
+                Web._encode_together(webs, self.runtime)
+        return results
@@ -1,12 +1,20 @@
-import torch
-from torch.nn.functional import cosine_similarity
+from collections.abc import Mapping, Sequence
+import numpy as np
 
 
-class Leaf(torch.Tensor):
+class Leaf:
     """
-    The Leaf class is a custom subclass of PyTorch's torch.Tensor, designed to represent an HTML element
-    with an associated feature embedding. It includes additional methods to calculate similarity and distance
-    between elements, as well as a boolean check for the existence of the tensor.
+    The Leaf class represents an HTML element through its feature embedding. It is a lightweight view of one row
+    of the feature matrix of a page, so creating a Leaf does not copy or allocate any embedding. It includes methods
+    to calculate similarity and distance between elements, as well as a boolean check for the existence of the
+    embedding.
+
+    Attributes:
+    -----------
+    matrix : numpy.ndarray
+        The feature matrix of the page the element belongs to.
+    index : int
+        The row of the element in the feature matrix.
 
     Methods:
     --------
@@ -17,11 +25,45 @@ class Leaf(torch.Tensor):
         Calculates the Manhattan distance (L1 distance) between this Leaf object and another.
 
     __bool__():
-        Returns whether the Leaf tensor is non-empty (contains elements).
+        Returns whether the Leaf embedding is non-empty (contains elements).
     """
+    __slots__ = ("matrix", "index")
+
+    def __init__(self, matrix, index: int = 0):
+        """
+        Initializes the Leaf as a view of a row of a feature matrix.
+
+        Parameters:
+        -----------
+        matrix : array like
+            The [N, D] feature matrix, or a single [D] embedding.
+        index : int, optional
+            The row of the element in the feature matrix. (default is 0)
+        """
+        matrix = np.asarray(matrix)
+        self.matrix = matrix if matrix.ndim == 2 else matrix.reshape(1, -1)
+        self.index = index
+
+    @property
+    def vector(self):
+        """
+        The embedding of the element, as a view of the feature matrix.
+        """
+        return self.matrix[self.index]
+
+    def __array__(self, dtype=None, copy=None):
+        vector = self.vector
+        return vector if dtype is None else vector.astype(dtype, copy=False)
+
+    def __len__(self):
+        return self.matrix.shape[1]
+
+    def __repr__(self):
+        return f"Leaf({self.vector!r})"
+
     def similarity(self, other):
         """
-        Computes the cosine similarity between the current Leaf tensor and another Leaf tensor.
+        Computes the cosine similarity between the current Leaf and another Leaf.
 
         Cosine similarity measures the cosine of the angle between two vectors, giving a value between -1 and 1,
         where 1 indicates perfect similarity, 0 indicates orthogonality, and -1 indicates perfect dissimilarity.
@@ -29,18 +71,19 @@ class Leaf(torch.Tensor):
         Parameters:
         -----------
         other : Leaf
-            The other Leaf tensor to compare with.
+            The other Leaf to compare with.
 
         Returns:
         --------
         float
             A similarity score between -1 and 1, where 1 indicates high similarity.
         """
-        return cosine_similarity(self.unsqueeze(0), other.unsqueeze(0)).detach().item()
+        a, b = self.vector.astype(np.float32, copy=False), np.asarray(other, dtype=np.float32)
+        return float(np.dot(a, b) / max(np.linalg.norm(a) * np.linalg.norm(b), 1e-8))
 
     def mdist(self, other):
         """
-        Computes the Manhattan distance (L1 distance) between the current Leaf tensor and another Leaf tensor.
+        Computes the Manhattan distance (L1 distance) between the current Leaf and another Leaf.
 
         Manhattan distance is the sum of the absolute differences between corresponding elements of two vectors.
         It is a measure of how different two vectors are, with higher values indicating greater dissimilarity.
@@ -48,24 +91,69 @@ class Leaf(torch.Tensor):
         Parameters:
         -----------
         other : Leaf
-            The other Leaf tensor to compare with.
+            The other Leaf to compare with.
 
         Returns:
         --------
         float
-            The Manhattan distance between the two tensors.
+            The Manhattan distance between the two embeddings.
         """
-        return torch.sum(torch.abs(self - other)).detach().item()
+        return float(np.abs(self.vector.astype(np.float32, copy=False) - np.asarray(other, dtype=np.float32)).sum())
 
     def __bool__(self):
         """
-        Checks whether the Leaf tensor is non-empty (i.e., contains elements).
+        Checks whether the Leaf embedding is non-empty (i.e., contains elements).
 
         This method allows Leaf objects to be used in boolean contexts such as conditions.
 
         Returns:
         --------
         bool
-            True if the Leaf tensor has more than zero elements, False otherwise.
+            True if the Leaf embedding has more than zero elements, False otherwise.
         """
-        return self.size().numel() > 0
+        return self.vector.size > 0
+
+
+class LeafSequence(Sequence):
+    """
+    A read only sequence of the Leaf objects of the rows of a feature matrix, creating each Leaf when it is accessed.
+    """
+    __slots__ = ("matrix",)
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Leaf(self.matrix, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Leaf index {index} is out of range.")
+        return Leaf(self.matrix, index)
+
+
+class LeafMapping(Mapping):
+    """
+    A read only mapping from XPaths to Leaf objects, creating each Leaf when it is looked up.
+    """
+    __slots__ = ("matrix", "rows")
+
+    def __init__(self, matrix, rows):
+        self.matrix = matrix
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def __getitem__(self, path):
+        return Leaf(self.matrix, self.rows[path])
@@ -0,0 +1,363 @@
+import json
+import os
+import time
+import numpy as np
+
+# The number of rows scored at once, bounds the memory used by a search
+BLOCK_SIZE = 65536
+
+
+class LeafIndex:
+    """
+    The LeafIndex class stores the leaf embeddings of many documents so that elements can be looked up across a
+    whole corpus, for example to find the price element of a new page from previously labelled pages.
+
+    Searches are either exact, scoring every stored leaf, or approximate, using an inverted file (IVF) index that
+    only scores the leaves of the clusters closest to the query. The index can be saved to a directory and loaded
+    back with its embeddings memory-mapped.
+
+    Attributes:
+    -----------
+    dims : int
+        The dimensionality of the stored embeddings.
+    metric : str
+        The distance used to rank leaves, either "l1" (Manhattan) or "cosine".
+    centroids : numpy.ndarray or None
+        The cluster centroids of the approximate index, or None until `build` is called.
+    """
+    def __init__(self, dims: int = 32, metric: str = "l1"):
+        """
+        Initializes an empty index.
+
+        Parameters:
+        -----------
+        dims : int, optional
+            The dimensionality of the stored embeddings. (default is 32)
+        metric : str, optional
+            The distance used to rank leaves, either "l1" or "cosine". (default is "l1")
+        """
+        assert metric in ("l1", "cosine"), f"Unknown distance metric [{metric}], expected l1 or cosine."
+        self.dims = dims
+        self.metric = metric
+        self.centroids = None
+        self._vectors = np.empty((0, dims), dtype=np.float32)
+        # The (vectors, doc number, lists) of the documents added since the arrays were last concatenated
+        self._pending = []
+        self._pending_rows = 0
+        self._docs = np.empty(0, dtype=np.int64)
+        self._lists = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._paths = []
+        self._doc_ids = []
+        self._doc_numbers = {}
+        self._metadata = {}
+        self._inverted = None
+
+    def __len__(self):
+        """
+        Returns the number of leaves in the index, not counting removed documents.
+        """
+        return int(self._alive.sum()) + self._pending_rows
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_numbers
+
+    @property
+    def doc_ids(self):
+        """
+        The ids of the documents in the index.
+        """
+        return list(self._doc_numbers)
+
+    def metadata(self, doc_id):
+        """
+        Returns the metadata stored with a document.
+        """
+        assert doc_id in self._doc_numbers, f"Document [{doc_id}] is not in the index."
+        return self._metadata.get(doc_id)
+
+    def add(self, doc_id, features, paths, metadata=None):
+        """
+        Adds the leaves of a document to the index.
+
+        Parameters:
+        -----------
+        doc_id : str or int
+            The id of the document, it must not already be in the index.
+        features : array like
+            The [N, dims] embeddings of the document's leaves, as returned by `WebGraphAutoEncoder.extract`.
+        paths : list of str
+            The XPath of each leaf.
+        metadata : dict, optional
+            JSON serializable information stored with the document. (default is None)
+        """
+        assert doc_id not in self._doc_numbers, f"Document [{doc_id}] is already in the index."
+        vectors = as_matrix(features)
+        assert vectors.shape == (len(paths), self.dims), \
+            f"Expected features of shape [{len(paths)}, {self.dims}] but got {list(vectors.shape)}."
+
+        number = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._doc_numbers[doc_id] = number
+        if metadata is not None:
+            self._metadata[doc_id] = metadata
+
+        # The arrays are only concatenated when they are read, so that adding documents is linear
+        self._pending.append((vectors, number, self._assign(vectors)))
+        self._pending_rows += len(vectors)
+        self._paths.extend(paths)
+        self._inverted = None
+
+    def add_web(self, doc_id, web, metadata=None):
+        """
+        Adds the leaves of a Web object to the index.
+        """
+        self.add(doc_id, web.features, web.paths, metadata)
+
+    def remove(self, doc_id):
+        """
+        Removes a document and its leaves from the index. The space is reclaimed by `compact` or `save`.
+        """
+        assert doc_id in self._doc_numbers, f"Document [{doc_id}] is not in the index."
+        number = self._doc_numbers.pop(doc_id)
+        self._metadata.pop(doc_id, None)
+        self._flush()
+        self._alive[self._docs == number] = False
+        self._inverted = None
+
+    def compact(self):
+        """
+        Drops the leaves of removed documents from storage.
+        """
+        vectors = self.vectors
+        keep = self._alive
+        if keep.all():
+            return
+        numbers = {number: i for i, number in enumerate(self._doc_numbers.values())}
+        self._vectors = np.ascontiguousarray(vectors[keep])
+        self._docs = np.array([numbers[number] for number in self._docs[keep]], dtype=np.int64)
+        self._lists = self._lists[keep]
+        self._paths = [path for path, alive in zip(self._paths, keep) if alive]
+        self._alive = np.ones(len(self._paths), dtype=bool)
+        self._doc_ids = list(self._doc_numbers)
+        self._doc_numbers = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+        self._inverted = None
+
+    @property
+    def vectors(self):
+        """
+        The [N, dims] matrix of all stored embeddings, including those of removed documents.
+        """
+        self._flush()
+        return self._vectors
+
+    def build(self, n_lists: int = None, iterations: int = 10, seed: int = 0):
+        """
+        Trains the approximate index by clustering the stored leaves with k-means.
+
+        Leaves added afterwards are assigned to their closest existing cluster, so the index only needs to be
+        rebuilt when the distribution of the corpus changes.
+
+        Parameters:
+        -----------
+        n_lists : int, optional
+            The number of clusters, defaults to the square root of the number of leaves.
+        iterations : int, optional
+            The number of k-means iterations. (default is 10)
+        seed : int, optional
+            The random seed used to pick the initial centroids. (default is 0)
+        """
+        self.compact()
+        vectors = self._normalized(self.vectors)
+        assert len(vectors), "Can not build an index without leaves."
+        n_lists = min(n_lists or int(np.sqrt(len(vectors))) or 1, len(vectors))
+
+        random = np.random.default_rng(seed)
+        centroids = vectors[random.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            lists = nearest_centroids(vectors, centroids)
+            counts = np.bincount(lists, minlength=n_lists)
+            sums = np.stack([np.bincount(lists, weights=column, minlength=n_lists) for column in vectors.T], axis=1)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Restart empty clusters from random leaves
+            centroids[empty] = vectors[random.choice(len(vectors), int(empty.sum()))]
+
+        self.centroids = centroids
+        self._lists = nearest_centroids(vectors, centroids)
+        self._inverted = None
+
+    def search(self, leaf, n: int = 10, exact: bool = False, n_probe: int = 8, budget: float = None):
+        """
+        Finds the N leaves of the corpus closest to the given leaf.
+
+        Parameters:
+        -----------
+        leaf : Leaf or array like
+            The embedding to search for.
+        n : int, optional
+            The number of results to return. (default is 10)
+        exact : bool, optional
+            Score every leaf instead of using the approximate index. This is also done when the index has not
+            been built. (default is False)
+        n_probe : int, optional
+            The number of closest clusters scored by an approximate search. (default is 8)
+        budget : float, optional
+            The latency budget in seconds. Once it is exceeded no more clusters (or blocks of leaves for an
+            exact search) are scored, and the best results found so far are returned. (default is None)
+
+        Returns:
+        --------
+        list of tuple
+            The (doc_id, xpath, distance) of the closest leaves, sorted by increasing distance.
+        """
+        query = as_matrix(leaf).reshape(-1)
+        assert len(query) == self.dims, f"Expected a query of size {self.dims} but got {len(query)}."
+        deadline = time.perf_counter() + budget if budget is not None else None
+        vectors = self.vectors
+
+        if exact or self.centroids is None:
+            candidates = (np.arange(start, min(start + BLOCK_SIZE, len(vectors)))
+                          for start in range(0, len(vectors), BLOCK_SIZE))
+        else:
+            order = np.argsort(nearest_distances(self._normalized(query[None]), self.centroids)[0])
+            inverted = self._inverted_lists()
+            candidates = (inverted[i] for i in order[:n_probe])
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0, dtype=np.float32)
+        for rows in candidates:
+            rows = rows[self._alive[rows]]
+            if len(rows):
+                distances = np.concatenate((best_distances, self._distances(query, vectors[rows])))
+                rows = np.concatenate((best_rows, rows))
+                if len(distances) > n:
+                    top = np.argpartition(distances, n)[:n]
+                    rows, distances = rows[top], distances[top]
+                best_rows, best_distances = rows, distances
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+        order = np.argsort(best_distances, kind="stable")
+        return [(self._doc_ids[self._docs[row]], self._paths[row], float(distance))
+                for row, distance in zip(best_rows[order], best_distances[order])]
+
+    def save(self, path: str):
+        """
+        Saves the index to a directory, compacting it first.
+
+        Parameters:
+        -----------
+        path : str
+            The directory to write the index to, it is created if needed.
+        """
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(path, "docs.npy"), self._docs)
+        np.save(os.path.join(path, "lists.npy"), self._lists)
+        if self.centroids is not None:
+            np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        with open(os.path.join(path, "paths.txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(self._paths))
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as file:
+            json.dump({"dims": self.dims, "metric": self.metric, "doc_ids": self._doc_ids,
+                       "metadata": [[doc_id, data] for doc_id, data in self._metadata.items()]}, file)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Loads an index saved with `save`.
+
+        Parameters:
+        -----------
+        path : str
+            The directory the index was saved to.
+        mmap : bool, optional
+            Memory-map the embeddings instead of reading them into memory. (default is True)
+
+        Returns:
+        --------
+        LeafIndex
+            The loaded index.
+        """
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as file:
+            info = json.load(file)
+        index = cls(info["dims"], info["metric"])
+        index._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index._docs = np.load(os.path.join(path, "docs.npy"))
+        index._lists = np.load(os.path.join(path, "lists.npy"))
+        index._alive = np.ones(len(index._docs), dtype=bool)
+        centroids = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids):
+            index.centroids = np.load(centroids)
+        with open(os.path.join(path, "paths.txt"), encoding="utf-8") as file:
+            index._paths = file.read().split("\n") if len(index._docs) else []
+        index._doc_ids = [doc_id for doc_id in info["doc_ids"]]
+        index._doc_numbers = {doc_id: i for i, doc_id in enumerate(index._doc_ids)}
+        index._metadata = {doc_id: data for doc_id, data in info["metadata"]}
+        return index
+
+    def _flush(self):
+        if not self._pending:
+            return
+        vectors, numbers, lists = zip(*self._pending)
+        self._vectors = np.concatenate((self._vectors,) + vectors)
+        self._docs = np.concatenate([self._docs] + [np.full(len(rows), number, dtype=np.int64)
+                                                    for rows, number in zip(vectors, numbers)])
+        self._lists = np.concatenate((self._lists,) + lists)
+        self._alive = np.concatenate((self._alive, np.ones(self._pending_rows, dtype=bool)))
+        self._pending = []
+        self._pending_rows = 0
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return nearest_centroids(self._normalized(vectors), self.centroids)
+
+    def _inverted_lists(self):
+        if self._inverted is None:
+            order = np.argsort(self._lists, kind="stable")
+            bounds = np.searchsorted(self._lists[order], np.arange(len(self.centroids) + 1))
+            self._inverted = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        return self._inverted
+
+    def _normalized(self, vectors):
+        if self.metric == "cosine":
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _distances(self, query, vectors):
+        if self.metric == "l1":
+            return np.abs(vectors - query).sum(axis=1)
+        vectors = self._normalized(vectors)
+        return 1 - vectors @ self._normalized(query[None])[0]
+
+
+def as_matrix(features):
+    """
+    Converts embeddings (a Leaf, a torch.Tensor or any array like) to a float32 NumPy array.
+    """
+    if hasattr(features, "detach"):
+        features = features.detach().cpu().numpy()
+    return np.asarray(features, dtype=np.float32)
+
+
+def nearest_distances(vectors, centroids):
+    """
+    Computes the squared euclidean distance between every vector and every centroid.
+    """
+    return (vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)[None]
+
+
+def nearest_centroids(vectors, centroids):
+    """
+    Returns the id of the closest centroid of each vector.
+    """
+    lists = np.empty(len(vectors), dtype=np.int64)
+    norms = (centroids ** 2).sum(axis=1)[None]
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        # The norm of the vector itself does not change which centroid is the closest
+        block = vectors[start:start + BLOCK_SIZE]
+        lists[start:start + BLOCK_SIZE] = (norms - 2 * block @ centroids.T).argmin(axis=1)
+    return lists
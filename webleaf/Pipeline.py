@@ -0,0 +1,204 @@
+from .Profiler import collect
+from .Runtime import get_default_runtime
+from .Web import Web
+from .model.WebGraphAutoEncoder import build_graph, union_edge_index
+from concurrent.futures import Future, ProcessPoolExecutor
+from lxml import etree
+import os
+import queue
+import threading
+import torch
+
+# The number of pages whose texts are embedded and whose graphs are encoded together
+BATCH_SIZE = 32
+# The number of batches each stage can hold before the stage feeding it has to wait
+QUEUE_SIZE = 4
+# How often, in seconds, a stage waiting on a queue checks whether the pipeline was closed
+POLL_INTERVAL = 0.1
+
+
+def parse_page(html):
+    """
+    Parses an HTML document and builds its graph, which is what the parsing processes run.
+    """
+    return build_graph(etree.ElementTree(etree.HTML(html)))
+
+
+def encode_stream(htmls, workers: int = None, batch_size: int = BATCH_SIZE, ordered: bool = True, runtime=None,
+                  queue_size: int = QUEUE_SIZE):
+    """
+    Encodes a stream of HTML documents, overlapping the parsing, text embedding and GCN stages.
+
+    The documents are parsed and turned into graphs by a pool of processes. A dedicated thread embeds the texts
+    of batches of parsed pages, and another one runs the GCN over the embedded batches, so that all the stages
+    work at the same time. Each stage only holds a bounded number of batches, so a slow stage makes the previous
+    ones wait instead of letting pages pile up in memory, and documents are only read from `htmls` as fast as
+    they are encoded.
+
+    Parameters:
+    -----------
+    htmls : iterable of str
+        The HTML documents to encode, consumed lazily.
+    workers : int, optional
+        The number of parsing processes, 0 parses the documents in a thread of this process instead.
+        (default is None, which uses one process per CPU)
+    batch_size : int, optional
+        The maximum number of pages embedded and encoded together. (default is BATCH_SIZE)
+    ordered : bool, optional
+        Whether the pages are yielded in the order of `htmls`, rather than as soon as they are encoded.
+        (default is True)
+    runtime : WebLeafRuntime, optional
+        The runtime holding the models, the shared default runtime is used when omitted. (default is None)
+    queue_size : int, optional
+        The number of batches each stage can hold. (default is QUEUE_SIZE)
+
+    Returns:
+    --------
+    generator of Web
+        The encoded pages.
+    """
+    assert batch_size > 0, "The batch size must be positive."
+    assert queue_size > 0, "The queue size must be positive."
+    runtime = runtime or get_default_runtime()
+    workers = os.cpu_count() if workers is None else workers
+    pool = ProcessPoolExecutor(workers) if workers else None
+    if pool:
+        # Start the processes before the stage threads exist, forking a process with running threads is unsafe
+        pool.submit(os.getpid).result()
+
+    stop = threading.Event()
+    # The pages being parsed, bounded by the number of slots so that parsing can not run far ahead
+    slots = threading.Semaphore(queue_size * batch_size)
+    parsed = queue.Queue()
+    embedded = queue.Queue(queue_size)
+    encoded = queue.Queue(queue_size)
+
+    def put(stage_queue, item):
+        while not stop.is_set():
+            try:
+                stage_queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(stage_queue):
+        while not stop.is_set():
+            try:
+                return stage_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return None
+
+    def parse_stage():
+        count = 0
+        try:
+            for number, html in enumerate(htmls):
+                if stop.is_set():
+                    return
+                while not slots.acquire(timeout=POLL_INTERVAL):
+                    if stop.is_set():
+                        return
+                if pool:
+                    future = pool.submit(parse_page, html)
+                else:
+                    future = Future()
+                    try:
+                        future.set_result(parse_page(html))
+                    except Exception as exception:
+                        future.set_exception(exception)
+                page = (number, html, future)
+                if ordered:
+                    parsed.put(page)
+                else:
+                    future.add_done_callback(lambda _, page=page: parsed.put(page))
+                count += 1
+            # Pages can still be parsing when unordered, so the end marker holds the number of pages to expect
+            parsed.put(_End(count))
+        except BaseException as exception:
+            parsed.put(_Failure(exception))
+
+    def embed_stage():
+        expected, seen = None, 0
+        try:
+            while expected is None or seen < expected:
+                item = get(parsed)
+                batch = []
+                while item is not None:
+                    if isinstance(item, _End):
+                        expected = item.count
+                    elif isinstance(item, _Failure):
+                        put(embedded, item)
+                        return
+                    else:
+                        batch.append(item)
+                    if len(batch) == batch_size or (expected is not None and seen + len(batch) >= expected):
+                        break
+                    try:
+                        item = parsed.get_nowait()
+                    except queue.Empty:
+                        item = None
+                if stop.is_set():
+                    return
+                if not batch:
+                    continue
+
+                webs = [Web._from_graph(html, future.result(), runtime) for _, html, future in batch]
+                seen += len(batch)
+                slots.release(len(batch))
+                # The stats of the batch are reported once the GCN stage is done with it
+                with collect(runtime, report=False, pages=len(webs)) as stats:
+                    input_features = runtime.encoder.embed_graphs([web.graph for web in webs])
+                if not put(embedded, (webs, input_features, stats)):
+                    return
+            put(embedded, None)
+        except BaseException as exception:
+            put(embedded, _Failure(exception))
+
+    def gcn_stage():
+        try:
+            while True:
+                item = get(embedded)
+                if item is None or isinstance(item, _Failure):
+                    put(encoded, item)
+                    return
+                webs, input_features, stats = item
+                with collect(runtime, stats):
+                    graphs = [web.graph for web in webs]
+                    features = runtime.encoder.run_gcn(input_features, union_edge_index(graphs))
+                sizes = [len(graph) for graph in graphs]
+                for web, page_features in zip(webs, torch.split(features, sizes)):
+                    web._set_features(page_features)
+                    web.stats = stats
+                if not put(encoded, webs):
+                    return
+        except BaseException as exception:
+            put(encoded, _Failure(exception))
+
+    threads = [threading.Thread(target=stage, daemon=True) for stage in [parse_stage, embed_stage, gcn_stage]]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            webs = get(encoded)
+            if webs is None:
+                return
+            if isinstance(webs, _Failure):
+                raise webs.exception
+            yield from webs
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _End:
+    def __init__(self, count):
+        self.count = count
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
@@ -0,0 +1,152 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import time
+
+# The stats of the encoding running in the current thread or task, None when profiling is disabled
+_current_stats = ContextVar("webleaf_stats", default=None)
+# The stage returned when profiling is disabled, which does nothing
+_NO_STAGE = nullcontext()
+
+
+class EncodingStats:
+    """
+    The EncodingStats class holds the measurements taken while parsing and encoding a page, or a batch of pages.
+
+    Attributes:
+    -----------
+    pages : int
+        The number of pages encoded together.
+    time : float
+        The wall time, in seconds, spent parsing and encoding the pages.
+    stages : dict
+        The wall time, in seconds, spent in each stage, in the order the stages first ran. The stages are "parse"
+        (lxml), "traverse" (building the graph), "diff" (matching the nodes of an updated page), "tokenize"
+        (finding the sentences and looking them up in the cache), "text_model" (the text model), "tags" (the
+        tag embeddings), "subtrees" (looking up and caching repeated subtrees), "gcn" and "empty_cache".
+    nodes : int
+        The number of nodes encoded by the GCN, counting each node of an overlapping partition.
+    texts : int
+        The number of texts sent to the text stage.
+    unique_texts : int
+        The number of distinct texts among them.
+    subtree_hits : int
+        The number of subtrees whose input features were reused from the subtree cache or from an identical
+        subtree encoded with them.
+    subtree_misses : int
+        The number of subtrees that were looked up in the subtree cache and embedded.
+    reused_nodes : int
+        The number of nodes whose input features were reused.
+    peak_memory : int
+        The peak number of bytes held by the tensors of the models. On CUDA this is measured by torch, on CPU it is
+        estimated from the size of the input features and of the GCN activations.
+    """
+    def __init__(self, pages: int = 1):
+        self.pages = pages
+        self.time = 0.0
+        self.stages = {}
+        self.nodes = 0
+        self.texts = 0
+        self.unique_texts = 0
+        self.subtree_hits = 0
+        self.subtree_misses = 0
+        self.reused_nodes = 0
+        self.peak_memory = 0
+
+    @property
+    def unique_text_ratio(self):
+        """
+        The fraction of the texts that are distinct, 1 when no text was embedded.
+        """
+        return self.unique_texts / self.texts if self.texts else 1.0
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_memory(self, nbytes):
+        self.peak_memory = max(self.peak_memory, nbytes)
+
+    def as_dict(self):
+        """
+        Returns the measurements as a dictionary, e.g. to be sent to a metrics system.
+        """
+        return {"pages": self.pages, "time": self.time, "stages": dict(self.stages), "nodes": self.nodes,
+                "texts": self.texts, "unique_texts": self.unique_texts,
+                "unique_text_ratio": self.unique_text_ratio, "subtree_hits": self.subtree_hits,
+                "subtree_misses": self.subtree_misses, "reused_nodes": self.reused_nodes,
+                "peak_memory": self.peak_memory}
+
+    def __repr__(self):
+        stages = ", ".join(f"{name}={seconds * 1000:.2f}ms" for name, seconds in self.stages.items())
+        return f"EncodingStats(pages={self.pages}, time={self.time * 1000:.2f}ms, nodes={self.nodes}, {stages})"
+
+
+class _Stage:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+
+
+def current_stats():
+    """
+    Returns the stats of the encoding running in the current thread or task, or None when it is not profiled.
+    """
+    return _current_stats.get()
+
+
+def stage(name):
+    """
+    Returns a context manager timing a stage of the current encoding, which does nothing when it is not profiled.
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        return _NO_STAGE
+    return _Stage(stats, name)
+
+
+@contextmanager
+def collect(runtime, stats=None, report=True, pages=1):
+    """
+    Profiles the encoding running inside the context, when the runtime has profiling enabled.
+
+    Nested collections add to the stats of the outermost one, which is the only one reporting them.
+
+    Parameters:
+    -----------
+    runtime : WebLeafRuntime
+        The runtime encoding the pages, whose `stats_sink` receives the stats.
+    stats : EncodingStats, optional
+        Stats to add to, e.g. those of a page that was parsed earlier. (default is None, which creates new stats)
+    report : bool, optional
+        Whether the stats are sent to the sink of the runtime when the context exits. (default is True)
+    pages : int, optional
+        The number of pages encoded inside the context. (default is 1)
+
+    Returns:
+    --------
+    EncodingStats or None
+        The stats of the encoding, or None when profiling is disabled.
+    """
+    current = _current_stats.get()
+    if current is not None or not runtime.profiling:
+        yield current
+        return
+
+    stats = stats or EncodingStats(pages)
+    token = _current_stats.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.time += time.perf_counter() - start
+        _current_stats.reset(token)
+        if report and runtime.stats_sink is not None:
+            runtime.stats_sink(stats)
@@ -0,0 +1,181 @@
+from .model.WebGraphAutoEncoder import WebGraphAutoEncoder
+from .model.SubtreeCache import SUBTREE_CACHE_SIZE
+from lxml import etree
+import gc
+import os
+import threading
+import weakref
+import torch
+
+# The example page encoded by `WebLeafRuntime.warmup`
+WARMUP_HTML = "<html><body><div><h1>WebLeaf</h1><p>Warming up the models.</p></div></body></html>"
+
+
+class WebLeafRuntime:
+    """
+    The WebLeafRuntime class owns the models used to encode pages and controls when they are loaded.
+
+    The models are loaded once, behind a lock, the first time they are needed (or when `warmup` is called), so
+    several threads can share a runtime without loading the models more than once. A runtime can also be
+    prepared before forking a pool of workers, so that the workers share the loaded weights copy-on-write
+    instead of each loading their own copy.
+
+    Attributes:
+    -----------
+    loaded : bool
+        Whether the models have been loaded.
+    profile : bool
+        Whether the pages encoded by the runtime are profiled, their stats being kept in `Web.stats`.
+    stats_sink : callable or None
+        A function receiving the EncodingStats of every page or batch encoded by the runtime, which enables
+        profiling on its own.
+    """
+    def __init__(self, tag_embedding_model=None, text_embedding_model=None, text_precision="float32",
+                 gcn_precision="float32", output_precision="float32", profile=False, stats_sink=None,
+                 subtree_cache_size=SUBTREE_CACHE_SIZE, gcn_backend="traced"):
+        """
+        Initializes the runtime without loading any model.
+
+        Parameters:
+        -----------
+        tag_embedding_model : TagEmbeddingModel, optional
+            The tag model to use, a new one is loaded when omitted. (default is None)
+        text_embedding_model : TextEmbeddingModel, optional
+            The text model to use, a new one is loaded when omitted. This is how the text embedding cache is
+            configured. (default is None)
+        text_precision : str, optional
+            The precision of the text model loaded when none is given, either "float32" or "int8".
+            (default is "float32")
+        gcn_precision : str, optional
+            The type of the GCN weights, either "float32", "bfloat16" or "float16". (default is "float32")
+        output_precision : str, optional
+            The type of the encoded features, either "float32" or "float16". (default is "float32")
+        profile : bool, optional
+            Whether the pages encoded by the runtime are profiled. (default is False)
+        stats_sink : callable, optional
+            A function receiving the EncodingStats of every page or batch encoded by the runtime.
+            (default is None)
+        subtree_cache_size : int, optional
+            The number of input feature rows kept by the cache of repeated subtrees, 0 disables the cache.
+            (default is SUBTREE_CACHE_SIZE)
+        gcn_backend : str, optional
+            Either "traced", which runs the GCN compiled with TorchScript, or "eager". (default is "traced")
+        """
+        self._tag_embedding_model = tag_embedding_model
+        self._text_embedding_model = text_embedding_model
+        self._precision = dict(text_precision=text_precision, gcn_precision=gcn_precision,
+                               output_precision=output_precision)
+        self._subtree_cache_size = subtree_cache_size
+        self._gcn_backend = gcn_backend
+        self.profile = profile
+        self.stats_sink = stats_sink
+        self._encoder = None
+        self._lock = threading.Lock()
+        self._num_threads = None
+        _runtimes.add(self)
+
+    @property
+    def loaded(self):
+        return self._encoder is not None
+
+    @property
+    def profiling(self):
+        return self.profile or self.stats_sink is not None
+
+    @property
+    def encoder(self):
+        """
+        The WebGraphAutoEncoder of the runtime, loaded on first access.
+        """
+        encoder = self._encoder
+        if encoder is None:
+            with self._lock:
+                if self._encoder is None:
+                    self._encoder = WebGraphAutoEncoder(self._tag_embedding_model, self._text_embedding_model,
+                                                        subtree_cache_size=self._subtree_cache_size,
+                                                        gcn_backend=self._gcn_backend,
+                                                        **self._precision)
+                encoder = self._encoder
+        return encoder
+
+    def warmup(self):
+        """
+        Loads the models and encodes a small page, so that the first real page does not pay any start up cost.
+
+        Returns:
+        --------
+        WebLeafRuntime
+            The runtime itself.
+        """
+        self.encoder.extract_batch([etree.ElementTree(etree.HTML(WARMUP_HTML))])
+        return self
+
+    def prepare_fork(self, num_threads: int = None):
+        """
+        Prepares the runtime to be shared by worker processes forked after this call.
+
+        The models are loaded and warmed up, their weights are moved to shared memory, and the objects that exist
+        at this point are frozen out of the garbage collector, so that the workers do not copy the pages holding
+        the weights when they touch them.
+
+        Parameters:
+        -----------
+        num_threads : int, optional
+            The number of torch threads used by each forked worker, avoiding oversubscription when many workers
+            share a machine. (default is None, which keeps torch's default)
+
+        Returns:
+        --------
+        WebLeafRuntime
+            The runtime itself.
+        """
+        self.warmup()
+        encoder = self.encoder
+        for model in [encoder.model, getattr(encoder.text_embedding_model, "model", None)]:
+            if isinstance(model, torch.nn.Module):
+                model.share_memory()
+        self._num_threads = num_threads
+        gc.freeze()
+        return self
+
+    def _after_fork(self):
+        # A lock held by another thread at fork time would never be released in the child
+        self._lock = threading.Lock()
+        if self._num_threads:
+            torch.set_num_threads(self._num_threads)
+
+
+def _after_fork_in_child():
+    global _default_runtime_lock
+    _default_runtime_lock = threading.Lock()
+    for runtime in list(_runtimes):
+        runtime._after_fork()
+
+
+_runtimes = weakref.WeakSet()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+# The runtime used by Web objects that are not given one explicitly
+_default_runtime = None
+_default_runtime_lock = threading.Lock()
+
+
+def get_default_runtime():
+    """
+    Returns the runtime shared by all Web objects that are not given one explicitly.
+    """
+    global _default_runtime
+    if _default_runtime is None:
+        with _default_runtime_lock:
+            if _default_runtime is None:
+                _default_runtime = WebLeafRuntime()
+    return _default_runtime
+
+
+def set_default_runtime(runtime):
+    """
+    Replaces the runtime shared by all Web objects that are not given one explicitly.
+    """
+    global _default_runtime
+    _default_runtime = runtime
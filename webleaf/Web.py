@@ -1,10 +1,17 @@
-from .Leaf import Leaf
-from .model.WebGraphAutoEncoder import WebGraphAutoEncoder
+from .Leaf import Leaf, LeafMapping, LeafSequence
+from .Profiler import collect, stage
+from .Runtime import get_default_runtime
+from .WebStore import read_page, write_page
+from .model.WebGraphAutoEncoder import build_graph, graph_elements, strip_formatting
 from lxml import etree
+from functools import lru_cache
+import numpy as np
+import os
+import torch
 from lxml.cssselect import CSSSelector
 
-# Global variable to hold the WebGraphAutoEncoder instance
-web_graph_auto_encoder = None
+# The number of compiled XPath and CSS selectors kept by the process
+SELECTOR_CACHE_SIZE = 1024
 
 
 class Web:
@@ -15,20 +22,32 @@ class Web:
 
     Attributes:
     -----------
-    html : str
-        The raw HTML content passed during initialization.
+    html : str or None
+        The raw HTML content passed during initialization, or None for a page loaded without its HTML.
+    runtime : WebLeafRuntime
+        The runtime holding the models used to encode the page.
     tree : lxml.etree.ElementTree
-        Parsed HTML tree.
-    features : list
+        Parsed HTML tree, parsed on first access for loaded pages.
+    graph : WebGraph
+        The nodes and edges extracted from the tree, built on first access for loaded pages.
+    edge_index : numpy.ndarray
+        The [2, E] edges of the graph, from parents to children.
+    max_memory : int or None
+        The memory cap used to encode the page in partitions, or None when it was encoded in one pass.
+    features : torch.Tensor
         The encoded feature vectors for each HTML element.
+    matrix : numpy.ndarray
+        The feature vectors as a NumPy array sharing the memory of `features`, which Leaf objects are views of.
+    encoded : bool
+        Whether the embeddings have been computed, which lazy pages only do on their first query.
+    stats : EncodingStats or None
+        The time spent in each stage of parsing and encoding the page, when its runtime profiles it.
     paths : list
         The XPath for each HTML element in the document.
-    leaves : list of Leaf
-        Leaf objects representing the elements of the HTML tree, based on their embeddings.
-    path_leaves : dict
-        A dictionary mapping XPaths to their corresponding Leaf objects.
+    path_rows : dict
+        A dictionary mapping XPaths to their row in the feature matrix.
     """
-    def __init__(self, html: str):
+    def __init__(self, html: str, runtime=None, max_memory: int = None, lazy: bool = False):
         """
         Initialize the Web object by parsing the provided HTML and encoding it into embeddings.
 
@@ -36,19 +55,272 @@ class Web:
         -----------
         html : str
             The HTML content to be parsed and encoded.
+        runtime : WebLeafRuntime, optional
+            The runtime holding the models, the shared default runtime is used when omitted. (default is None)
+        max_memory : int, optional
+            Encode the page in partitions, keeping the memory used by the models under this many bytes. This is
+            meant for huge documents. (default is None)
+        lazy : bool, optional
+            Only parse the page and build its graph now, the embeddings are computed (and the models loaded)
+            on the first query or call to `encode`. (default is False)
 
         Raises:
         -------
         AssertionError if the HTML content is invalid.
         """
-        global web_graph_auto_encoder
+        self.runtime = runtime or get_default_runtime()
+        self.max_memory = max_memory
+        # Lazy pages are only reported once they are encoded
+        with collect(self.runtime, report=not lazy) as self.stats:
+            self._parse(html)
+            if not lazy:
+                self.encode()
+
+    @classmethod
+    def from_many(cls, htmls, batch_size: int = 32, runtime=None):
+        """
+        Creates a Web object for each of the provided HTML documents, encoding them in batches.
+
+        Each batch is encoded with a single text embedding call and a single GCN forward pass, which removes the
+        per-page model overhead that dominates the encoding time of small pages.
+
+        Parameters:
+        -----------
+        htmls : iterable of str
+            The HTML documents to be parsed and encoded.
+        batch_size : int, optional
+            The number of documents encoded together. (default is 32)
+        runtime : WebLeafRuntime, optional
+            The runtime holding the models, the shared default runtime is used when omitted. (default is None)
+
+        Returns:
+        --------
+        list of Web
+            A Web object for each document, in the order the documents were given.
+        """
+        assert batch_size > 0, "The batch size must be positive."
+        runtime = runtime or get_default_runtime()
+        htmls = list(htmls)
+        webs = []
+        for start in range(0, len(htmls), batch_size):
+            chunk = htmls[start:start + batch_size]
+            with collect(runtime, pages=len(chunk)):
+                batch = [cls(html, runtime=runtime, lazy=True) for html in chunk]
+                cls._encode_together(batch, runtime)
+            webs.extend(batch)
+        return webs
+
+    @staticmethod
+    def _encode_together(webs, runtime):
+        # A single text embedding call and GCN pass for all the pages
+        features = runtime.encoder.encode_graphs([web.graph for web in webs])
+        for web, page_features in zip(webs, features):
+            web._set_features(page_features)
+
+    @classmethod
+    def load(cls, path: str, offset: int = 0, runtime=None):
+        """
+        Loads a page written by `save`, without loading any model.
+
+        The features are memory mapped rather than read, so opening a page is cheap however large it is. The
+        HTML tree is only parsed when it is needed, e.g. to find an element by XPath or to update the page.
+
+        Parameters:
+        -----------
+        path : str
+            The file holding the page.
+        offset : int, optional
+            The byte offset of the page in the file. (default is 0)
+        runtime : WebLeafRuntime, optional
+            The runtime used if the page is updated, the shared default runtime is used when omitted.
+            (default is None)
+
+        Returns:
+        --------
+        Web
+            The stored page.
+        """
+        matrix, edge_index, paths, html = read_page(path, offset)
+        web = cls.__new__(cls)
+        web.runtime = runtime or get_default_runtime()
+        web.max_memory = None
+        web.stats = None
+        web.html = html
+        web._tree = None
+        web._graph = None
+        web._element_rows = None
+        web._edge_index = edge_index
+        web.paths = paths
+        web.path_rows = {path: i for i, path in enumerate(paths)}
+        web._set_features(torch.from_numpy(matrix))
+        return web
+
+    def save(self, path, dtype: str = None, include_html: bool = True):
+        """
+        Writes the encoded page to a file, so it can be loaded again without encoding it.
+
+        Parameters:
+        -----------
+        path : str or file object
+            The file the page is written to, an open binary file is written at its current position.
+        dtype : str, optional
+            The type the features are stored with, either "float32" or "float16" which halves the size of the
+            file. (default is None, which keeps the type of the features)
+        include_html : bool, optional
+            Whether the HTML is stored, which queries by XPath or CSS selector and updates need. (default is True)
+
+        Returns:
+        --------
+        int
+            The number of bytes written.
+        """
+        html = self.html if include_html else None
+        if isinstance(path, (str, os.PathLike)):
+            with open(path, "wb") as file:
+                return write_page(file, self.matrix, self.edge_index, self.paths, html, dtype)
+        return write_page(path, self.matrix, self.edge_index, self.paths, html, dtype)
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            assert self.html is not None, "The page was stored without its HTML."
+            # Formatting tags are stripped as when the graph was built, so that the XPaths match
+            self._tree = strip_formatting(etree.ElementTree(etree.HTML(self.html)))
+        return self._tree
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = build_graph(self.tree)
+        return self._graph
+
+    @property
+    def edge_index(self):
+        if self._edge_index is None:
+            self._edge_index = self.graph.edge_index
+        return self._edge_index
+
+    @property
+    def encoded(self):
+        """
+        Whether the embeddings of the page have been computed.
+        """
+        return self._features is not None
+
+    @property
+    def features(self):
+        """
+        The encoded feature vectors for each HTML element, computed on first access for lazy pages.
+        """
+        return self.encode()._features
+
+    @property
+    def matrix(self):
+        """
+        The feature vectors as a NumPy array sharing the memory of `features`, which Leaf objects are views of.
+        """
+        return self.encode()._matrix
+
+    def encode(self):
+        """
+        Computes the embeddings of the page, if they have not been computed yet.
+
+        Returns:
+        --------
+        Web
+            The Web object itself.
+        """
+        if self._features is None:
+            with collect(self.runtime, self.stats) as self.stats:
+                encoder = self.runtime.encoder
+                if self.max_memory:
+                    self._set_features(encoder.encode_graph_streaming(self.graph, self.max_memory))
+                else:
+                    self._set_features(encoder.encode_graphs([self.graph])[0])
+        return self
+
+    def update(self, html: str):
+        """
+        Replaces the HTML content with a new version of the same page, re-encoding only what changed.
+
+        The new tree is diffed against the previous one by XPath. Text and tag embeddings are only recomputed
+        for nodes whose text or tag changed, and the GCN only runs over the nodes within its receptive field of
+        those changes. The result is the same as creating a new Web object from the new HTML. A lazy page that
+        has not been encoded yet stays lazy.
+
+        Parameters:
+        -----------
+        html : str
+            The new HTML content of the page.
+
+        Returns:
+        --------
+        list of str
+            The XPaths of the elements whose embeddings were recomputed.
+        """
+        graph, features = self.graph, self._features
+        with collect(self.runtime, report=features is not None) as self.stats:
+            self._parse(html)
+            if features is None:
+                return []
+
+            if self.max_memory:
+                # The subgraph of the changes could exceed the memory cap, so the page is encoded in partitions
+                self.encode()
+                return list(self.paths)
+
+            features, updated = self.runtime.encoder.update_graph(graph, features, self.graph)
+            self._set_features(features)
+        return [self.paths[i] for i in updated.tolist()]
+
+    @classmethod
+    def _from_graph(cls, html, graph, runtime=None):
+        # Pages whose graph was built elsewhere, e.g. in another process, only parse their tree when needed
+        web = cls.__new__(cls)
+        web.runtime = runtime or get_default_runtime()
+        web.max_memory = None
+        web.stats = None
+        web._set_graph(html, graph)
+        return web
+
+    def _parse(self, html):
+        with stage("parse"):
+            tree = etree.ElementTree(etree.HTML(html))
+        with stage("traverse"):
+            graph = build_graph(tree)
+        self._set_graph(html, graph, tree)
+
+    def _set_graph(self, html, graph, tree=None):
         self.html = html
-        if not web_graph_auto_encoder:
-            web_graph_auto_encoder = WebGraphAutoEncoder()
-        self.tree = etree.ElementTree(etree.HTML(html))
-        self.features, self.paths = web_graph_auto_encoder.extract(self.tree)
-        self.leaves = [Leaf(feat) for feat in self.features]
-        self.path_leaves = {path: leaf for path, leaf in zip(self.paths, self.leaves)}
+        self._tree = tree
+        self._graph = graph
+        self._element_rows = None
+        self._edge_index = None
+        self.paths = graph.paths
+        self.path_rows = {path: i for i, path in enumerate(self.paths)}
+        self._features = None
+        self._matrix = None
+
+    def _set_features(self, features):
+        self._features = features.contiguous()
+        # Leaves are views of rows of this matrix, which shares its memory with the features tensor
+        self._matrix = self._features.numpy()
+
+    @property
+    def leaves(self):
+        """
+        Leaf objects representing the elements of the HTML tree, as a sequence creating each Leaf when it is
+        accessed.
+        """
+        return LeafSequence(self.matrix)
+
+    @property
+    def path_leaves(self):
+        """
+        A read only mapping from XPaths to their corresponding Leaf objects, creating each Leaf when it is looked
+        up.
+        """
+        return LeafMapping(self.matrix, self.path_rows)
 
     def leaf(self, xpath: str = "", css_select: str = "") -> Leaf:
         """
@@ -71,14 +343,67 @@ class Web:
         -------
         AssertionError if neither an XPath nor a CSS selector is provided, or if the element is not found.
         """
-        if css_select:
-            xpath = CSSSelector(css_select).path
-        assert xpath, "When creating a WebLeaf please provide either a xpath or css selector."
-        elements = self.tree.xpath(xpath)
-        assert len(elements), f"Could not find elements at xpath [{xpath}] in html."
+        matrix = self.matrix
+        assert xpath or css_select, "When creating a WebLeaf please provide either a xpath or css selector."
+        selector = compile_selector(css_select, css=True) if css_select else compile_selector(xpath)
+        elements = selector(self.tree)
+        assert len(elements), f"Could not find elements at xpath [{selector.path}] in html."
         path = self.tree.getpath(elements[0])
-        assert path in self.path_leaves, f"The element at [{path}] was not processed by webleaf."
-        return self.path_leaves[path]
+        assert path in self.path_rows, f"The element at [{path}] was not processed by webleaf."
+        return Leaf(matrix, self.path_rows[path])
+
+    def leaves_for(self, selectors, css: bool = False, strict: bool = True):
+        """
+        Extracts the elements matched by many selectors at once, e.g. the fields of an extraction template.
+
+        The selectors are compiled once per process, and the matched elements are mapped to their rows through an
+        index of the elements of the page, built on the first call, instead of computing their XPath.
+
+        Parameters:
+        -----------
+        selectors : list of str
+            The XPath queries, or CSS selectors, locating the elements. The first match of each one is used.
+        css : bool, optional
+            Whether the selectors are CSS selectors rather than XPath queries. (default is False)
+        strict : bool, optional
+            Whether a selector that matches nothing raises. Otherwise its row of the matrix is NaN and its path is
+            None. (default is True)
+
+        Returns:
+        --------
+        tuple
+            The [S, D] numpy.ndarray holding the embedding of the element of each selector, and the list of the
+            XPaths of these elements.
+
+        Raises:
+        -------
+        AssertionError if strict and a selector does not match any element processed by webleaf.
+        """
+        matrix = self.matrix
+        tree = self.tree
+        element_rows = self._get_element_rows()
+        rows = []
+        for selector in selectors:
+            selector = compile_selector(selector, css)
+            elements = selector(tree)
+            row = element_rows.get(elements[0], -1) if len(elements) else -1
+            assert row >= 0 or not strict, f"Could not find an element processed by webleaf at [{selector.path}]."
+            rows.append(row)
+
+        rows = np.array(rows, dtype=np.int64)
+        leaves = matrix[rows]
+        if not strict:
+            leaves[rows < 0] = np.nan
+        return leaves, [self.paths[row] if row >= 0 else None for row in rows.tolist()]
+
+    def _get_element_rows(self):
+        # Maps the elements of the tree to their row, the index keeps their proxy objects alive so that lxml returns
+        # the same objects for them
+        if self._element_rows is None:
+            elements = graph_elements(self.tree)
+            assert len(elements) == len(self.paths), "The HTML tree does not match the graph of the page."
+            self._element_rows = {element: row for row, element in enumerate(elements)}
+        return self._element_rows
 
     def find(self, leaf: Leaf):
         """
@@ -96,7 +421,7 @@ class Web:
          """
         return self.find_n(leaf, 1)[0]
 
-    def find_n(self, leaf: Leaf, n):
+    def find_n(self, leaf: Leaf, n, metric: str = "l1"):
         """
         Finds the top N most similar elements to the given Leaf object,
         based on their embeddings' distance.
@@ -107,13 +432,100 @@ class Web:
             The Leaf object to compare against other elements in the tree.
         n : int
             The number of top similar elements to return.
+        metric : str, optional
+            The distance used to rank the elements, either "l1" (Manhattan) or "cosine". (default is "l1")
 
         Returns:
         --------
         list of str
             A list of XPaths corresponding to the top N most similar elements.
         """
-        path_dists = [(path, leaf.mdist(other)) for other, path in zip(self.leaves, self.paths)]
-        sorted_path_dists = sorted(path_dists, key=lambda path_dist: path_dist[1])
-        sorted_paths = [path for path, dist in sorted_path_dists]
-        return sorted_paths[:n]
+        return self.find_many([leaf], n, metric=metric)[0]
+
+    def find_many(self, leaves, n, metric: str = "l1"):
+        """
+        Finds the top N most similar elements for each of the given Leaf objects.
+
+        All the leaves are scored against every element of the page in a single matrix operation.
+
+        Parameters:
+        -----------
+        leaves : list of Leaf
+            The Leaf objects to compare against the elements in the tree.
+        n : int
+            The number of top similar elements to return for each leaf.
+        metric : str, optional
+            The distance used to rank the elements, either "l1" (Manhattan) or "cosine". (default is "l1")
+
+        Returns:
+        --------
+        list of list of str
+            For each leaf, a list of XPaths corresponding to its top N most similar elements.
+        """
+        if not len(leaves):
+            return []
+        if n <= 0:
+            return [[] for _ in leaves]
+        queries = torch.from_numpy(np.stack([np.asarray(leaf, dtype=np.float32) for leaf in leaves]))
+        distances = pairwise_distances(queries, torch.from_numpy(self.matrix).float(), metric)
+        n = min(n, distances.size(1))
+        if n == distances.size(1):
+            indices = torch.argsort(distances, dim=1, stable=True).tolist()
+        else:
+            # Identical sibling subtrees have identical features, so the candidates are every element within the
+            # n-th distance, ties included, which are then ranked by distance and document order
+            thresholds = torch.topk(distances, n, dim=1, largest=False, sorted=True).values[:, -1:]
+            indices = []
+            for row, candidates in zip(distances, distances <= thresholds):
+                candidates = candidates.nonzero().flatten()
+                order = torch.argsort(row[candidates], stable=True)
+                indices.append(candidates[order].tolist())
+        return [[self.paths[i] for i in row[:n]] for row in indices]
+
+
+@lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_selector(selector: str, css: bool = False):
+    """
+    Compiles an XPath query or a CSS selector, keeping the most recently used ones for the whole process.
+
+    Parameters:
+    -----------
+    selector : str
+        The XPath query or CSS selector.
+    css : bool, optional
+        Whether the selector is a CSS selector. (default is False)
+
+    Returns:
+    --------
+    lxml.etree.XPath
+        The compiled query, whose `path` is the XPath it evaluates.
+    """
+    if css:
+        return CSSSelector(selector)
+    return etree.XPath(selector)
+
+
+def pairwise_distances(queries, features, metric="l1"):
+    """
+    Computes the distance between every query and every feature vector.
+
+    Parameters:
+    -----------
+    queries : torch.Tensor
+        A [Q, D] tensor of query embeddings.
+    features : torch.Tensor
+        A [N, D] tensor of element embeddings.
+    metric : str, optional
+        Either "l1" for the Manhattan distance or "cosine" for one minus the cosine similarity. (default is "l1")
+
+    Returns:
+    --------
+    torch.Tensor
+        A [Q, N] tensor of distances.
+    """
+    if metric == "l1":
+        return torch.cdist(queries, features, p=1)
+    assert metric == "cosine", f"Unknown distance metric [{metric}], expected l1 or cosine."
+    queries = torch.nn.functional.normalize(queries, dim=1)
+    features = torch.nn.functional.normalize(features, dim=1)
+    return 1 - queries @ features.T
@@ -0,0 +1,204 @@
+import json
+import os
+import struct
+import numpy as np
+
+# The bytes every stored page starts with
+MAGIC = b"WEBLEAF\x01"
+# The alignment of the blocks of a stored page, so that they can be memory mapped
+ALIGNMENT = 64
+# The default number of pages written to each shard of a store
+SHARD_PAGES = 65536
+# The feature types a page can be stored with
+DTYPES = ("float32", "float16")
+
+
+class WebStore:
+    """
+    A sharded on disk store of encoded pages, meant to hold corpora of millions of pages.
+
+    A store is a directory holding the shards, each shard being the stored pages written one after the other,
+    and an `index.json` file recording the shard and offset of every page. Opening a store only reads the index,
+    and reading a page memory maps its features, so no model is loaded and no embedding is copied.
+
+    Attributes:
+    -----------
+    path : str
+        The directory holding the store.
+    pages : list
+        The shard and byte offset of each stored page.
+    """
+    def __init__(self, path: str):
+        """
+        Opens an existing store.
+
+        Parameters:
+        -----------
+        path : str
+            The directory holding the store.
+        """
+        self.path = path
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as file:
+            info = json.load(file)
+        self.shards = info["shards"]
+        self.pages = info["pages"]
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, number):
+        from .Web import Web
+        shard, offset = self.pages[number]
+        return Web.load(os.path.join(self.path, self.shards[shard]), offset=offset)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
+    @classmethod
+    def pack(cls, webs, path: str, dtype: str = None, include_html: bool = True, shard_pages: int = SHARD_PAGES):
+        """
+        Writes the given pages to a new store.
+
+        Parameters:
+        -----------
+        webs : iterable of Web
+            The pages to store, they are encoded first when needed. The pages are consumed one at a time, so
+            a generator can be used to pack more pages than fit in memory.
+        path : str
+            The directory the store is written to.
+        dtype : str, optional
+            The type the features are stored with, either "float32" or "float16". (default is None, which keeps
+            the type of the features)
+        include_html : bool, optional
+            Whether the HTML of the pages is stored, which queries by XPath or CSS selector need. (default is True)
+        shard_pages : int, optional
+            The number of pages written to each shard. (default is SHARD_PAGES)
+
+        Returns:
+        --------
+        WebStore
+            The new store.
+        """
+        assert shard_pages > 0, "The number of pages per shard must be positive."
+        os.makedirs(path, exist_ok=True)
+        shards, pages = [], []
+        file = None
+        try:
+            for web in webs:
+                if len(pages) % shard_pages == 0:
+                    if file:
+                        file.close()
+                    shards.append(f"shard-{len(shards):05d}.wleaf")
+                    file = open(os.path.join(path, shards[-1]), "wb")
+                pages.append([len(shards) - 1, file.tell()])
+                web.save(file, dtype=dtype, include_html=include_html)
+        finally:
+            if file:
+                file.close()
+
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as file:
+            json.dump({"shards": shards, "pages": pages}, file)
+        return cls(path)
+
+
+def write_page(file, matrix, edge_index, paths, html=None, dtype=None):
+    """
+    Writes an encoded page at the current position of a binary file.
+
+    A stored page is a small JSON header followed by the feature matrix, the edge index, the XPaths and
+    optionally the HTML of the page. Each block starts on a 64 byte boundary so that it can be memory mapped.
+
+    Parameters:
+    -----------
+    file : file object
+        The binary file the page is written to.
+    matrix : numpy.ndarray
+        The [N, D] feature matrix of the page.
+    edge_index : numpy.ndarray
+        The [2, E] edges between the elements of the page.
+    paths : list of str
+        The XPath of each element of the page.
+    html : str, optional
+        The HTML of the page. (default is None)
+    dtype : str, optional
+        The type the features are stored with, either "float32" or "float16". (default is None, which keeps the
+        type of the features)
+
+    Returns:
+    --------
+    int
+        The number of bytes written.
+    """
+    dtype = dtype or matrix.dtype.name
+    assert dtype in DTYPES, f"Unknown feature type [{dtype}], expected one of {DTYPES}."
+    blocks = [
+        ("features", np.ascontiguousarray(matrix, dtype=dtype).tobytes()),
+        ("edge_index", np.ascontiguousarray(edge_index, dtype=np.int64).tobytes()),
+        ("paths", "\n".join(paths).encode("utf-8")),
+    ]
+    if html is not None:
+        blocks.append(("html", html.encode("utf-8")))
+
+    header = {"dtype": dtype, "shape": list(matrix.shape), "edges": int(edge_index.shape[1])}
+    # The offsets depend on the size of the header, which depends on the offsets, so the header is padded
+    header_size = aligned(len(MAGIC) + 8 + len(json.dumps(header)) + 64 * (len(blocks) + 1))
+    offset = header_size
+    for name, data in blocks:
+        header[name] = [offset, len(data)]
+        offset = aligned(offset + len(data))
+    header["size"] = offset
+
+    encoded = json.dumps(header).encode("utf-8")
+    assert len(MAGIC) + 8 + len(encoded) <= header_size, "The header of the page does not fit its block."
+    start = file.tell()
+    file.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+    for name, data in blocks:
+        file.write(b"\0" * (start + header[name][0] - file.tell()))
+        file.write(data)
+    file.write(b"\0" * (start + offset - file.tell()))
+    return offset
+
+
+def read_page(path, offset=0):
+    """
+    Reads a page written by `write_page`, memory mapping its features.
+
+    Parameters:
+    -----------
+    path : str
+        The file holding the page.
+    offset : int, optional
+        The byte offset of the page in the file. (default is 0)
+
+    Returns:
+    --------
+    tuple
+        The [N, D] feature matrix, the [2, E] edge index, the list of XPaths and the HTML of the page (or None
+        when it was not stored).
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        magic, size = file.read(len(MAGIC)), file.read(8)
+        assert magic == MAGIC, f"[{path}] does not hold a WebLeaf page at offset {offset}."
+        header = json.loads(file.read(struct.unpack("<Q", size)[0]))
+
+        def read(name):
+            start, size = header[name]
+            file.seek(offset + start)
+            return file.read(size).decode("utf-8")
+
+        paths = read("paths").split("\n") if header["paths"][1] else []
+        html = read("html") if "html" in header else None
+
+    n_nodes, dims = header["shape"]
+    # Copy on write, so the features can be wrapped in a tensor without ever modifying the file
+    matrix = np.memmap(path, dtype=header["dtype"], mode="c", offset=offset + header["features"][0],
+                       shape=(n_nodes, dims)) if n_nodes else np.empty((0, dims), dtype=header["dtype"])
+    edge_index = np.memmap(path, dtype=np.int64, mode="r", offset=offset + header["edge_index"][0],
+                           shape=(2, header["edges"])) if header["edges"] else np.empty((2, 0), dtype=np.int64)
+    return matrix, edge_index, paths, html
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
@@ -3,3 +3,8 @@
 """
 from .Leaf import Leaf
 from .Web import Web
+from .LeafIndex import LeafIndex
+from .Runtime import WebLeafRuntime
+from .WebStore import WebStore
+from .Pipeline import encode_stream
+from .AsyncWebLeaf import AsyncWebLeaf
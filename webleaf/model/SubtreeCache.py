@@ -0,0 +1,186 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+import torch
+
+# The default number of input feature rows kept by the cache
+SUBTREE_CACHE_SIZE = 16384
+# The largest subtree, in nodes, cached as a single block
+MAX_BLOCK_NODES = 256
+
+
+class SubtreeLookup:
+    """
+    The result of looking up the subtrees of a batch of graphs in a SubtreeFeatureCache.
+
+    The rows are those of the disjoint union of the graphs, numbered in the order the graphs were given.
+
+    Attributes:
+    -----------
+    missing : numpy.ndarray
+        The rows whose input features have to be embedded.
+    hits : int
+        The number of subtrees whose features were reused, from the cache or from an identical subtree of the batch.
+    misses : int
+        The number of cacheable subtrees that were not found.
+    reused : int
+        The number of rows whose features were reused.
+    """
+    def __init__(self, rows):
+        self.missing = []
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        # The row each row copies its features from, itself when it is not reused
+        self._source = np.arange(rows, dtype=np.int64)
+        self._cached = []
+        self._new_blocks = {}
+
+
+class SubtreeFeatureCache:
+    """
+    A cache of the GCN input features of subtrees, keyed on their structural hash (see `WebGraph.subtrees`).
+
+    Pages of a site share their header, navigation and footer, and listing pages repeat the same tiles, so the
+    text and tag embeddings of these subtrees are reused instead of being computed again. A block holds the input
+    features of the nodes of a subtree in depth first order. The least recently used blocks are evicted once the
+    cache holds more than `capacity` rows.
+
+    Attributes:
+    -----------
+    capacity : int
+        The maximum number of input feature rows kept by the cache.
+    max_block : int
+        The largest subtree, in nodes, cached as a single block. Larger subtrees are looked up child by child.
+    hits : int
+        The number of subtrees whose features were reused.
+    misses : int
+        The number of cacheable subtrees that had to be embedded.
+    """
+    def __init__(self, capacity=SUBTREE_CACHE_SIZE, max_block=MAX_BLOCK_NODES):
+        """
+        Initializes an empty cache.
+
+        Parameters:
+        -----------
+        capacity : int, optional
+            The maximum number of input feature rows kept by the cache. (default is SUBTREE_CACHE_SIZE)
+        max_block : int, optional
+            The largest subtree, in nodes, cached as a single block. (default is MAX_BLOCK_NODES)
+        """
+        assert capacity >= 0, "The cache capacity can not be negative."
+        assert max_block > 1, "The blocks must hold more than one node."
+        self.capacity = capacity
+        self.max_block = max_block
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._rows = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def rows(self):
+        """
+        The number of input feature rows held by the cache.
+        """
+        return self._rows
+
+    def lookup(self, graphs):
+        """
+        Finds the subtrees of a batch of graphs whose input features are cached or repeated within the batch.
+
+        The nodes are walked in depth first order. A subtree of at most `max_block` nodes that is found is reused
+        as a whole, otherwise its root is embedded and its children are looked up in turn. Single nodes are not
+        cached, their text embeddings are already cached by the text model.
+
+        Parameters:
+        -----------
+        graphs : list of WebGraph
+            The graphs encoded together.
+
+        Returns:
+        --------
+        SubtreeLookup
+            The rows to embed and the rows to reuse, to be passed to `resolve` once the missing rows are embedded.
+        """
+        lookup = SubtreeLookup(sum(len(graph) for graph in graphs))
+        source = lookup._source
+        offset = 0
+        with self._lock:
+            for graph in graphs:
+                hashes, sizes = graph.subtrees()
+                nodes = graph.preorder()
+                order, nodes = nodes + offset, nodes.tolist()
+                position = 0
+                while position < len(graph):
+                    node = nodes[position]
+                    size = sizes[node]
+                    if size == 1 or size > self.max_block:
+                        lookup.missing.append(node + offset)
+                        position += 1
+                        continue
+
+                    key = hashes[node]
+                    rows = order[position:position + size]
+                    block = self._blocks.get(key)
+                    first = lookup._new_blocks.get(key) if block is None else None
+                    if block is not None:
+                        self._blocks.move_to_end(key)
+                        lookup._cached.append((rows, block))
+                    elif first is not None:
+                        # A repeat of a subtree of the batch, copied once the first one is embedded
+                        source[rows] = source[first]
+                    else:
+                        lookup._new_blocks[key] = rows
+                        lookup.misses += 1
+                        lookup.missing.append(node + offset)
+                        position += 1
+                        continue
+                    lookup.hits += 1
+                    lookup.reused += size
+                    position += size
+                offset += len(graph)
+            self.hits += lookup.hits
+            self.misses += lookup.misses
+        lookup.missing = np.sort(np.array(lookup.missing, dtype=np.int64))
+        return lookup
+
+    def resolve(self, lookup, input_features):
+        """
+        Copies the reused rows into the input features of a batch, and caches the subtrees that were embedded.
+
+        Parameters:
+        -----------
+        lookup : SubtreeLookup
+            The lookup of the batch, as returned by `lookup`.
+        input_features : torch.Tensor
+            The input features of the batch, whose missing rows have been embedded.
+        """
+        for rows, block in lookup._cached:
+            input_features[torch.from_numpy(rows)] = block
+        copied = np.flatnonzero(lookup._source != np.arange(len(lookup._source)))
+        if len(copied):
+            input_features[torch.from_numpy(copied)] = input_features[torch.from_numpy(lookup._source[copied])]
+
+        with self._lock:
+            for key, rows in lookup._new_blocks.items():
+                if len(rows) > self.capacity or key in self._blocks:
+                    continue
+                self._blocks[key] = input_features[torch.from_numpy(rows)]
+                self._rows += len(rows)
+            while self._rows > self.capacity:
+                _, block = self._blocks.popitem(last=False)
+                self._rows -= len(block)
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._rows = 0
+            self.hits = 0
+            self.misses = 0
@@ -21,6 +21,9 @@ html_tags = [
     'var', 'video', 'wbr'
 ]
 
+# The id of each HTML tag in the embedding table
+html_tag_ids = {tag: i for i, tag in enumerate(html_tags)}
+
 exclude_html_tags = [
     "script", "meta", "style", "svg",
 ]
@@ -89,11 +92,15 @@ class TagEmbeddingModel:
     -----------
     embedding_model : NormalizedEmbedding
         The model that handles tag embeddings and their normalization.
+    table : torch.Tensor
+        The frozen [len(html_tags), TAG_DIMS] table of normalized embeddings, computed once at load time.
 
     Methods:
     --------
     get_tag_embedding(tags):
         Retrieves the embeddings for a list of HTML tags.
+    get_tag_embedding_by_id(tag_ids, out=None):
+        Retrieves the embeddings for a list of HTML tag ids.
     """
     def __init__(self):
         """
@@ -106,6 +113,11 @@ class TagEmbeddingModel:
         self.embedding_model = NormalizedEmbedding(len(html_tags), TAG_DIMS)
         assert os.path.exists(TAG_PATH), f"Could not find tag model at [{TAG_PATH}]"
         self.embedding_model.load_state_dict(torch.load(TAG_PATH))
+        self.embedding_model.eval()
+        with torch.no_grad():
+            # The embeddings never change, so they are normalized once for every tag
+            self.table = self.embedding_model(torch.arange(len(html_tags))).contiguous()
+        self.table.requires_grad_(False)
 
     def get_tag_embedding(self, tags):
         """
@@ -121,4 +133,22 @@ class TagEmbeddingModel:
          torch.Tensor
              A tensor containing the embeddings for the specified HTML tags.
          """
-        return self.embedding_model(torch.tensor([html_tags.index(tag) for tag in tags]))
+        return self.get_tag_embedding_by_id([html_tag_ids[tag] for tag in tags])
+
+    def get_tag_embedding_by_id(self, tag_ids, out=None):
+        """
+         Retrieves the embeddings for the provided HTML tag ids with a single lookup in the precomputed table.
+
+         Parameters:
+         -----------
+         tag_ids : array like of int
+             The ids (positions in `html_tags`) of the HTML tags for which to retrieve the embeddings.
+         out : torch.Tensor, optional
+             A [len(tag_ids), TAG_DIMS] tensor, or view of one, the embeddings are written into.
+
+         Returns:
+         --------
+         torch.Tensor
+             A tensor containing the embeddings for the specified HTML tags.
+         """
+        return torch.index_select(self.table, 0, torch.as_tensor(tag_ids, dtype=torch.int64), out=out)
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+import json
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - file locking is not available on windows
+    fcntl = None
+
+# The default number of text embeddings kept in memory
+CACHE_SIZE = 16384
+
+
+class TextEmbeddingCache:
+    """
+    A content addressed cache of text embeddings, keyed on the sentence that was embedded.
+
+    The cache keeps the most recently used embeddings in memory and evicts the least recently used ones once it
+    holds more than `capacity` entries. When a `path` is given the embeddings are also persisted to disk, so they
+    survive restarts and can be shared between worker processes. The disk store is made of two append only files:
+
+    - `<path>.f32`: the embeddings as raw float32 rows, read through a memory map.
+    - `<path>.idx`: one JSON encoded `[row, sentence]` pair per line.
+
+    Attributes:
+    -----------
+    capacity : int
+        The maximum number of embeddings kept in memory.
+    dims : int
+        The dimensionality of the cached embeddings.
+    path : str or None
+        The prefix of the disk store files, or None when the cache only lives in memory.
+    hits : int
+        The number of lookups that were answered by the cache.
+    misses : int
+        The number of lookups that had to be sent to the model.
+    """
+    def __init__(self, dims, capacity=CACHE_SIZE, path=None):
+        """
+        Initializes the cache, opening the disk store when a path is given.
+
+        Parameters:
+        -----------
+        dims : int
+            The dimensionality of the cached embeddings.
+        capacity : int, optional
+            The maximum number of embeddings kept in memory. (default is CACHE_SIZE)
+        path : str, optional
+            The prefix of the disk store files. (default is None)
+        """
+        assert capacity >= 0, "The cache capacity can not be negative."
+        self.dims = dims
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._rows = {}
+        self._index_offset = 0
+        self._vectors = None
+        self._lock = threading.RLock()
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            for suffix in [".f32", ".idx"]:
+                open(path + suffix, "ab").close()
+            self._refresh()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, sentence):
+        return sentence in self._memory or sentence in self._rows
+
+    def get(self, sentence, refresh=True):
+        """
+        Looks up the embedding of a sentence, counting the lookup as a hit or a miss.
+
+        Parameters:
+        -----------
+        sentence : str
+            The sentence to look up.
+        refresh : bool, optional
+            Whether a sentence missing from the disk store reads the rows other processes appended since it was
+            last read. A batch of lookups rather calls `refresh` once before them. (default is True)
+
+        Returns:
+        --------
+        numpy.ndarray or None
+            The cached embedding, or None when the sentence is not in the cache.
+        """
+        with self._lock:
+            return self._get(sentence, refresh)
+
+    def refresh(self):
+        """
+        Reads the rows appended to the disk store by other processes since it was last read.
+        """
+        if self.path:
+            with self._lock:
+                self._refresh()
+
+    def _get(self, sentence, refresh=True):
+        embedding = self._memory.get(sentence)
+        if embedding is not None:
+            self._memory.move_to_end(sentence)
+            self.hits += 1
+            return embedding
+
+        if self.path:
+            if refresh and sentence not in self._rows:
+                self._refresh()
+            row = self._rows.get(sentence)
+            if row is not None:
+                embedding = np.array(self._vectors[row])
+                self._remember(sentence, embedding)
+                self.hits += 1
+                return embedding
+
+        self.misses += 1
+        return None
+
+    def put(self, sentences, embeddings):
+        """
+        Adds the embeddings of the given sentences to the cache, persisting them when the cache has a disk store.
+
+        Parameters:
+        -----------
+        sentences : list of str
+            The sentences that were embedded.
+        embeddings : numpy.ndarray
+            A 2D array holding the embedding of each sentence.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dims)
+        with self._lock:
+            for sentence, embedding in zip(sentences, embeddings):
+                self._remember(sentence, embedding)
+            if self.path:
+                self._persist(sentences, embeddings)
+
+    def clear(self):
+        """
+        Empties the in memory cache and resets the hit and miss counters. The disk store is left untouched.
+        """
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _remember(self, sentence, embedding):
+        self._memory[sentence] = embedding
+        self._memory.move_to_end(sentence)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def _persist(self, sentences, embeddings):
+        rows = [i for i, sentence in enumerate(sentences) if sentence not in self._rows]
+        if not rows:
+            return
+        with open(self.path + ".idx", "a", encoding="utf-8") as index:
+            if fcntl:
+                fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended rows since we last looked
+                row = os.path.getsize(self.path + ".f32") // (self.dims * 4)
+                with open(self.path + ".f32", "ab") as vectors:
+                    vectors.write(np.ascontiguousarray(embeddings[rows]).tobytes())
+                index.write("".join(json.dumps([row + i, sentences[r]]) + "\n" for i, r in enumerate(rows)))
+                index.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(index, fcntl.LOCK_UN)
+        self._refresh()
+
+    def _refresh(self):
+        if os.path.getsize(self.path + ".idx") == self._index_offset:
+            # Nothing was appended since the index was last read
+            return
+        with open(self.path + ".idx", "r", encoding="utf-8") as index:
+            index.seek(self._index_offset)
+            for line in iter(index.readline, ""):
+                if not line.endswith("\n"):
+                    # A line that is still being written, pick it up on the next refresh
+                    break
+                row, sentence = json.loads(line)
+                self._rows.setdefault(sentence, row)
+                self._index_offset = index.tell()
+
+        n_rows = os.path.getsize(self.path + ".f32") // (self.dims * 4)
+        if n_rows and (self._vectors is None or len(self._vectors) < n_rows):
+            self._vectors = np.memmap(self.path + ".f32", dtype=np.float32, mode="r", shape=(n_rows, self.dims))
@@ -1,9 +1,117 @@
-from sentence_transformers import SentenceTransformer
-import nltk
-from nltk.tokenize import sent_tokenize
+import os
+import re
+import numpy as np
+from .TextCache import TextEmbeddingCache, CACHE_SIZE
+from ..Profiler import stage
 
 # The dimensionality of the text embeddings produced by the model
 TEXT_DIMS = 384
+# The HuggingFace id of the text model, or the directory of a local copy of it
+TEXT_MODEL = os.environ.get("WEBLEAF_TEXT_MODEL", "sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
+# The NLTK resources used by sent_tokenize, depending on the NLTK version
+PUNKT_RESOURCES = ["punkt", "punkt_tab"]
+# Punkt only ends sentences after one of these characters, so a text without them is a single sentence
+SENTENCE_END = re.compile(r"[.?!]")
+# The precisions the text model can run with, int8 dynamically quantizes the weights of its linear layers
+TEXT_PRECISIONS = ("float32", "int8")
+
+
+def downloads_allowed():
+    """
+    Returns whether missing models may be downloaded on first use. Downloads are opt-in through WEBLEAF_DOWNLOAD=1,
+    and WEBLEAF_OFFLINE or HF_HUB_OFFLINE forbid them even then.
+    """
+    def enabled(name):
+        return os.environ.get(name, "0") not in ("", "0")
+    return enabled("WEBLEAF_DOWNLOAD") and not any(enabled(name) for name in ["WEBLEAF_OFFLINE", "HF_HUB_OFFLINE"])
+
+
+def load_sentence_tokenizer():
+    """
+    Returns the English Punkt tokenizer used by NLTK's sent_tokenize, only downloading it when it is not
+    installed yet and downloads are allowed.
+    """
+    import nltk
+    try:
+        return load_punkt_tokenizer()
+    except LookupError:
+        assert downloads_allowed(), "The NLTK Punkt tokenizer is not installed, run `python -m " \
+                                    "webleaf.model.TextModel` to download it or set WEBLEAF_DOWNLOAD=1."
+        for resource in PUNKT_RESOURCES:
+            nltk.download(resource, quiet=True)
+    return load_punkt_tokenizer()
+
+
+def load_punkt_tokenizer():
+    try:
+        # NLTK 3.8.2 and later read the Punkt parameters from the punkt_tab tables
+        from nltk.tokenize.punkt import PunktTokenizer
+        return PunktTokenizer("english")
+    except ImportError:
+        import nltk
+        return nltk.data.load("tokenizers/punkt/english.pickle")
+
+
+def first_sentence(tokenizer, text):
+    """
+    Returns the first sentence of a text, the same as `sent_tokenize(text)[0]`, or "" when the text has none.
+
+    Texts that can not hold a sentence break skip the tokenizer altogether, and the others are only tokenized
+    up to the end of their first sentence.
+
+    Parameters:
+    -----------
+    tokenizer : nltk.tokenize.punkt.PunktSentenceTokenizer
+        The Punkt tokenizer, as returned by `load_sentence_tokenizer`.
+    text : str
+        The text to split.
+
+    Returns:
+    --------
+    str
+        The first sentence of the text.
+    """
+    if not SENTENCE_END.search(text):
+        # Punkt strips the trailing whitespace of the last sentence
+        return text.rstrip()
+    for start, end in tokenizer.span_tokenize(text):
+        return text[start:end]
+    return ""
+
+
+def load_sentence_transformer():
+    """
+    Returns the SentenceTransformer text model, only downloading it when there is no local copy yet and downloads
+    are allowed.
+    """
+    from sentence_transformers import SentenceTransformer
+    try:
+        return SentenceTransformer(TEXT_MODEL, local_files_only=True)
+    except OSError:
+        assert downloads_allowed(), f"The text model [{TEXT_MODEL}] is not available locally, run `python -m " \
+                                    f"webleaf.model.TextModel` to download it or set WEBLEAF_DOWNLOAD=1."
+        return SentenceTransformer(TEXT_MODEL)
+
+
+def download_text_assets():
+    """
+    Downloads the Punkt tokenizer and the text model ahead of time, for example while building a worker image,
+    so that later processes start without any network access.
+    """
+    import nltk
+    for resource in PUNKT_RESOURCES:
+        nltk.download(resource, quiet=True)
+    from sentence_transformers import SentenceTransformer
+    SentenceTransformer(TEXT_MODEL)
+
+
+def quantize_linear_layers(model):
+    """
+    Returns a copy of a model whose linear layers use int8 weights, their activations being quantized on the fly.
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
 
 class TextEmbeddingModel:
     """
@@ -14,45 +122,109 @@ class TextEmbeddingModel:
 
     Attributes:
     -----------
+    tokenizer : nltk.tokenize.punkt.PunktSentenceTokenizer
+        The Punkt tokenizer used to find the first sentence of each text.
     model : SentenceTransformer
         The pre-trained SentenceTransformer model used to generate text embeddings.
+    cache : TextEmbeddingCache
+        The cache of previously generated sentence embeddings.
+    precision : str
+        The precision the model runs with, either "float32" or "int8".
+    empty_embedding : numpy.ndarray
+        The embedding of the empty string, used for every node without text.
 
     Methods:
     --------
     get_text_embeddings(text):
         Generates embeddings for the input text data.
     """
-    def __init__(self):
+    def __init__(self, cache_size=CACHE_SIZE, cache_path=None, precision="float32", model=None, tokenizer=None):
         """
-        Initializes the TextEmbeddingModel by downloading necessary NLTK data and loading the pre-trained model.
+        Initializes the TextEmbeddingModel by loading NLTK's 'punkt' tokenizer and the pre-trained model.
+
+        NLTK's 'punkt' tokenizer is used to tokenize input text into sentences, and the SentenceTransformer model
+        'multi-qa-MiniLM-L6-cos-v1' is loaded to generate embeddings. Both have to be installed locally, either with
+        `python -m webleaf.model.TextModel` or by setting WEBLEAF_DOWNLOAD=1 to download them on first use.
 
-        NLTK's 'punkt' tokenizer is downloaded to tokenize input text into sentences, and the SentenceTransformer model
-        'multi-qa-MiniLM-L6-cos-v1' is loaded to generate embeddings.
+        Parameters:
+        -----------
+        cache_size : int, optional
+            The number of sentence embeddings kept in memory. (default is CACHE_SIZE)
+        cache_path : str, optional
+            The prefix of the files used to persist the sentence embeddings between processes. Models running
+            with different precisions should not share these files. (default is None)
+        precision : str, optional
+            Either "float32", or "int8" to dynamically quantize the linear layers of the model, which makes it
+            faster on CPU at the cost of slightly different embeddings. (default is "float32")
+        model : object, optional
+            The model encoding the sentences, any object whose `encode(sentences)` returns a [len(sentences),
+            TEXT_DIMS] array, e.g. a stand-in for the benchmarks. (default is None, which loads the
+            SentenceTransformer model)
+        tokenizer : nltk.tokenize.punkt.PunktSentenceTokenizer, optional
+            The tokenizer finding the first sentence of each text. (default is None, which loads the English Punkt
+            tokenizer)
         """
-        for resource in ["punkt", "punkt_tab"]:
-            nltk.download(resource)
-        self.model = SentenceTransformer('sentence-transformers/multi-qa-MiniLM-L6-cos-v1')
+        assert precision in TEXT_PRECISIONS, f"Unknown text precision [{precision}]."
+        self.tokenizer = load_sentence_tokenizer() if tokenizer is None else tokenizer
+        self.model = load_sentence_transformer() if model is None else model
+        self.precision = precision
+        if precision == "int8":
+            self.model = quantize_linear_layers(self.model)
+        self.cache = TextEmbeddingCache(TEXT_DIMS, capacity=cache_size, path=cache_path)
+        # The empty string is embedded once here, so that nodes without text never reach the model
+        self.empty_embedding = self.model.encode([""])[0]
 
-    def get_text_embeddings(self, text):
+    def get_text_embeddings(self, text, out=None):
         """
         Generates embeddings for a list of text strings. Each text string is tokenized into its first sentence,
         and that sentence is encoded into a dense embedding using the pre-trained SentenceTransformer model.
+        Duplicate texts are only tokenized once, and only sentences missing from the cache are sent to the model,
+        each of them once.
 
         Parameters:
         -----------
         text : list of str
             A list of text strings for which embeddings are to be generated.
+        out : numpy.ndarray, optional
+            A [len(text), TEXT_DIMS] float32 array the embeddings are written into, instead of a new array.
 
         Returns:
         --------
         numpy.ndarray
             A 2D array of embeddings where each row represents the embedding of a sentence from the input text.
         """
-        sentences = []
-        for t in text:
-            sentence = sent_tokenize(t)
-            if sentence:
-                sentences.append(sentence[0])
-            else:
-                sentences.append("")
-        return self.model.encode(sentences)
+        with stage("tokenize"):
+            # Each distinct text is only split and looked up once
+            rows = {}
+            for i, t in enumerate(text):
+                rows.setdefault(t, []).append(i)
+
+            embeddings = out if out is not None else np.empty((len(text), TEXT_DIMS), dtype=np.float32)
+            # The disk store is read once for the whole batch rather than on every miss
+            self.cache.refresh()
+            missing = {}
+            for t, ids in rows.items():
+                sentence = first_sentence(self.tokenizer, t) if t else ""
+                if not sentence:
+                    embeddings[ids] = self.empty_embedding
+                elif sentence in missing:
+                    missing[sentence].extend(ids)
+                else:
+                    embedding = self.cache.get(sentence, refresh=False)
+                    if embedding is None:
+                        missing[sentence] = ids
+                    else:
+                        embeddings[ids] = embedding
+
+        if missing:
+            missing_sentences = list(missing)
+            with stage("text_model"):
+                missing_embeddings = self.model.encode(missing_sentences)
+            self.cache.put(missing_sentences, missing_embeddings)
+            for sentence, embedding in zip(missing_sentences, missing_embeddings):
+                embeddings[missing[sentence]] = embedding
+        return embeddings
+
+
+if __name__ == "__main__":
+    download_text_assets()
@@ -1,25 +1,41 @@
-from torch_geometric.nn import GAE, GCN2Conv
 import torch.nn.functional as F
-from .TagModel import TagEmbeddingModel, exclude_html_tags, html_tags, TAG_DIMS
-from .TextModel import TextEmbeddingModel, TEXT_DIMS
-from torch_geometric.utils import subgraph
+from .TagModel import TagEmbeddingModel, exclude_html_tags, html_tags, html_tag_ids, TAG_DIMS
+from .TextModel import TextEmbeddingModel, TEXT_DIMS, TEXT_PRECISIONS
+from .SubtreeCache import SubtreeFeatureCache, SUBTREE_CACHE_SIZE
+from ..Profiler import current_stats, stage
 from torch.nn import Linear
 import os
 from lxml import etree
 from pathlib import Path
+from collections import Counter, deque
+from array import array
+import numpy as np
 import torch
 import re
 
 MODEL_PATH = os.path.join(Path(__file__).parent.absolute(), f"product_page_model_4_80.torch")
 EMBEDDING_DIMENSIONS = 32
-
-tag_embedding_model = None
-text_embedding_model = None
+HIDDEN_CHANNELS = 128
+# The number of texts embedded at once by the streaming encoder
+TEXT_BATCH_SIZE = 256
+# The formatting tags removed from the trees before building their graph
+FORMATTING_TAGS = ['b', 'i', 'u', 'strong', 'em', 'mark', 'small', 'del', 'ins']
+# The characters removed from the texts of the elements
+UNWANTED_CHARACTERS = re.compile(r'[^a-zA-Z\s.,!?\'\";:]')
+# The attributes whose text is used for elements without text of their own
+TEXT_ATTRIBUTES = ("alt", "tite", "aria-label")
+# The types the GCN weights can be cast to
+GCN_PRECISIONS = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+# The types the encoded features can be kept in
+OUTPUT_PRECISIONS = {"float32": torch.float32, "float16": torch.float16}
+# The ways the GCN can be run, "traced" runs InferenceGCNEncoder compiled with TorchScript
+GCN_BACKENDS = ("eager", "traced")
 
 
 class GCNEncoder(torch.nn.Module):
     def __init__(self, input_channels, hidden_channels, output_channels, num_layers, alpha, theta, shared_weights=True, dropout=0.0):
         super().__init__()
+        from torch_geometric.nn import GCN2Conv
 
         self.lins = torch.nn.ModuleList()
         self.lins.append(Linear(input_channels, hidden_channels))
@@ -48,18 +64,351 @@ class GCNEncoder(torch.nn.Module):
         return x
 
 
+class InferenceGCNEncoder(torch.nn.Module):
+    """
+    An inference only version of GCNEncoder, for graphs where every node has at most one parent (trees and forests).
+
+    The adjacency of such a graph has at most one entry per row, so instead of the scatter of each GCN2Conv layer
+    the messages are gathered from the parent of each node, whose index is computed once per graph. The layers do
+    not normalize the adjacency nor add self loops, so nothing else has to be prepared. Dropout is left out, the
+    scaled initial features are only computed once, and the activations are updated in place. The module shares
+    the weights of the encoder it is built from, and its results match it up to floating point error.
+    """
+    def __init__(self, encoder):
+        super().__init__()
+        self.lins = encoder.lins
+        self.weights = torch.nn.ParameterList([conv.weight1 for conv in encoder.convs])
+        self.alpha = encoder.convs[0].alpha
+        self.betas = [conv.beta for conv in encoder.convs]
+
+    def forward(self, x, parents, roots):
+        x = self.lins[0](x).relu()
+        x_0 = self.alpha * x
+        for weight, beta in zip(self.weights, self.betas):
+            x = x.index_select(0, parents).index_fill_(0, roots, 0.0)
+            x = x.mul_(1 - self.alpha).add_(x_0)
+            x = torch.addmm(x, x, weight, beta=1. - beta, alpha=beta).relu_()
+        return self.lins[1](x)
+
+
+def tree_adjacency(edge_index, num_nodes):
+    """
+    Returns the parent of each node of a forest and the nodes without parents, the compressed form of its adjacency.
+
+    Parameters:
+    -----------
+    edge_index : torch.Tensor
+        The [2, E] int64 tensor of [parent, child] edges.
+    num_nodes : int
+        The number of nodes of the graph.
+
+    Returns:
+    --------
+    tuple or None
+        The parent of each node (the node itself for roots) and the ids of the roots, as int64 tensors. None when
+        a node has several parents.
+    """
+    if edge_index.size(1) and torch.bincount(edge_index[1], minlength=num_nodes).max() > 1:
+        return None
+    parents = torch.arange(num_nodes)
+    parents[edge_index[1]] = edge_index[0]
+    return parents, (parents == torch.arange(num_nodes)).nonzero().flatten()
+
+
+class WebGraph:
+    """
+    The node level description of an HTML tree, before any of it has been embedded.
+
+    Attributes:
+    -----------
+    texts : list of str
+        The cleaned text of each node.
+    tag_ids : numpy.ndarray
+        The int64 id (position in `html_tags`) of the HTML tag of each node.
+    edge_index : numpy.ndarray
+        The [2, E] int64 array of [parent, child] node ids of the tree.
+    paths : list of str
+        The XPath of each node.
+    """
+    def __init__(self, texts, tag_ids, edge_index, paths):
+        self.texts = texts
+        self.tag_ids = tag_ids
+        self.edge_index = edge_index
+        self.paths = paths
+        self._subtrees = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def tags(self):
+        """
+        The (normalized) HTML tag of each node.
+        """
+        return [html_tags[tag_id] for tag_id in self.tag_ids]
+
+    def parents(self):
+        """
+        Returns the parent id of each node, or -1 for the root.
+        """
+        parents = np.full(len(self), -1, dtype=np.int64)
+        parents[self.edge_index[1]] = self.edge_index[0]
+        return parents.tolist()
+
+    def preorder(self):
+        """
+        Returns the node ids in depth first order, so that every subtree is a contiguous range of the order.
+        """
+        parents = np.full(len(self), -1, dtype=np.int64)
+        parents[self.edge_index[1]] = self.edge_index[0]
+        children = np.argsort(parents, kind="stable")
+        bounds = np.searchsorted(parents[children], np.arange(-1, len(self)), side="right").tolist()
+        children = children.tolist()
+
+        order = []
+        stack = children[:bounds[0]][::-1]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(reversed(children[bounds[node]:bounds[node + 1]]))
+        return np.array(order, dtype=np.int64)
+
+    def subtrees(self):
+        """
+        Returns the structural hash and the size of the subtree of each node.
+
+        The hash of a subtree covers the tag and text of its root and the hashes of its children in document order,
+        so two subtrees with the same hash have the same input features, node for node in depth first order. The
+        hashes use Python's hash, so they are only comparable within a process.
+
+        Returns:
+        --------
+        tuple
+            The hash (int) of each node's subtree, and the number of nodes of each subtree (int).
+        """
+        if self._subtrees is None:
+            # The nodes are numbered breadth first, so the children of a node are consecutive and numbered after it
+            parents = np.full(len(self), -1, dtype=np.int64)
+            parents[self.edge_index[1]] = self.edge_index[0]
+            assert (np.diff(parents[1:]) >= 0).all(), "The nodes of the graph are not numbered breadth first."
+            bounds = (np.searchsorted(parents[1:], np.arange(len(self) + 1)) + 1).tolist()
+
+            hashes = [0] * len(self)
+            sizes = [1] * len(self)
+            tag_ids, texts = self.tag_ids.tolist(), self.texts
+            for node in range(len(self) - 1, -1, -1):
+                first, last = bounds[node], bounds[node + 1]
+                if first < last:
+                    hashes[node] = hash((tag_ids[node], texts[node], *hashes[first:last]))
+                    sizes[node] += sum(sizes[first:last])
+                else:
+                    hashes[node] = hash((tag_ids[node], texts[node]))
+            self._subtrees = hashes, sizes
+        return self._subtrees
+
+
+def union_edge_index(graphs):
+    """
+    Packs the edges of several graphs into the [2, E] edge index of their disjoint union.
+
+    Parameters:
+    -----------
+    graphs : list of WebGraph
+        The graphs to pack, their nodes are numbered in the order the graphs are given.
+
+    Returns:
+    --------
+    torch.Tensor
+        The int64 edge index of the union graph.
+    """
+    if len(graphs) == 1:
+        return torch.from_numpy(graphs[0].edge_index)
+    offsets = np.cumsum([0] + [len(graph) for graph in graphs[:-1]])
+    return torch.from_numpy(np.concatenate([graph.edge_index + offset for graph, offset in zip(graphs, offsets)],
+                                           axis=1))
+
+
+def strip_formatting(tree):
+    """
+    Removes the formatting tags of an HTML tree in place, keeping their text and children.
+
+    Parameters:
+    -----------
+    tree : lxml.etree.ElementTree
+        The parsed HTML tree.
+
+    Returns:
+    --------
+    lxml.etree.ElementTree
+        The same tree, so that the XPaths of its elements match those of its graph.
+    """
+    etree.strip_tags(tree.getroot(), *FORMATTING_TAGS)
+    return tree
+
+
+def build_graph(tree):
+    """
+    Walks an HTML tree breadth first and collects the nodes and edges of its graph.
+
+    The walk is linear in the number of elements: XPaths are built from the parent's path and a per-parent
+    count of sibling tags (matching `tree.getpath`), and the edges are collected as a flat array of parent ids.
+
+    Parameters:
+    -----------
+    tree : lxml.etree.ElementTree
+        The parsed HTML tree. Formatting tags are stripped from it in place.
+
+    Returns:
+    --------
+    WebGraph
+        The nodes and edges of the tree.
+    """
+    root = strip_formatting(tree).getroot()
+
+    exclude_tag_lookup = set(exclude_html_tags)
+    div_id = html_tag_ids["div"]
+    assert tree, "Could not create tree"
+
+    queue = deque([(root, 0, tree.getpath(root))])
+    texts = [""]
+    tag_ids = array("q", [html_tag_ids.get(root.tag, div_id)])
+    parents = array("q", [-1])
+    paths = [queue[0][2]]
+    while queue:
+        element, parent_id, parent_path = queue.popleft()
+
+        # Count the element children of each tag, the XPath of a child only has an index when it has siblings
+        # with the same tag
+        tag_counts = Counter(child.tag for child in element if isinstance(child.tag, str))
+        tag_seen = dict.fromkeys(tag_counts, 0)
+        for child in element:
+            if isinstance(child, etree._Comment):
+                continue
+
+            path = None
+            if isinstance(child.tag, str):
+                tag_seen[child.tag] += 1
+                if tag_counts[child.tag] > 1:
+                    path = f"{parent_path}/{child.tag}[{tag_seen[child.tag]}]"
+                else:
+                    path = f"{parent_path}/{child.tag}"
+
+            while child.tag == "div" and len(child) == 1:
+                child = child[0]
+                path = f"{path}/{child.tag}" if isinstance(child.tag, str) else None
+
+            if child.tag not in exclude_tag_lookup:
+                tag_ids.append(html_tag_ids.get(child.tag, div_id))
+                text = extract_text(child)[:256]
+                texts.append(text)
+                if path is None:
+                    # Processing instructions and entities, which never have children of their own
+                    path = tree.getpath(child)
+                paths.append(path)
+                queue.append((child, len(parents), path))
+                parents.append(parent_id)
+
+    parents = np.frombuffer(parents, dtype=np.int64)
+    edge_index = np.stack((parents[1:], np.arange(1, len(parents), dtype=np.int64)))
+    return WebGraph(texts, np.frombuffer(tag_ids, dtype=np.int64), edge_index, paths)
+
+
+def graph_elements(tree):
+    """
+    Returns the element of each node of the graph of a tree, walking the tree in the same order as `build_graph`.
+
+    Parameters:
+    -----------
+    tree : lxml.etree.ElementTree
+        The parsed HTML tree, whose formatting tags have been stripped.
+
+    Returns:
+    --------
+    list of lxml.etree._Element
+        The element of each node, in the order of the rows of the graph.
+    """
+    exclude_tag_lookup = set(exclude_html_tags)
+    root = tree.getroot()
+    elements = [root]
+    queue = deque([root])
+    while queue:
+        for child in queue.popleft():
+            if isinstance(child, etree._Comment):
+                continue
+            while child.tag == "div" and len(child) == 1:
+                child = child[0]
+            if child.tag not in exclude_tag_lookup:
+                elements.append(child)
+                queue.append(child)
+    return elements
+
+
+def clean_text(text):
+    if not text:
+        return
+    cleaned_text = ' '.join(UNWANTED_CHARACTERS.sub('', text).split())
+    return cleaned_text
+
+
+def extract_text(element) -> str:
+    text = clean_text(element.text)
+    if text:
+        return text
+
+    for label in TEXT_ATTRIBUTES:
+        text = clean_text(element.get(label))
+        if text:
+            return text
+    return ""
+
+
 class WebGraphAutoEncoder:
-    def __init__(self):
-        global tag_embedding_model
-        if not tag_embedding_model:
-            tag_embedding_model = TagEmbeddingModel()
+    def __init__(self, tag_embedding_model=None, text_embedding_model=None, text_precision="float32",
+                 gcn_precision="float32", output_precision="float32", subtree_cache_size=SUBTREE_CACHE_SIZE,
+                 gcn_backend="traced"):
+        """
+        Loads the models used to encode pages.
 
-        global text_embedding_model
-        if not text_embedding_model:
-            text_embedding_model = TextEmbeddingModel()
+        The reduced precision modes trade some accuracy for speed and memory, `benchmarks/precision_drift.py`
+        measures how much they change the results of `find` and `find_n`.
+
+        Parameters:
+        -----------
+        tag_embedding_model : TagEmbeddingModel, optional
+            The tag model to use, a new one is loaded when omitted. (default is None)
+        text_embedding_model : TextEmbeddingModel, optional
+            The text model to use, a new one is loaded when omitted. (default is None)
+        text_precision : str, optional
+            The precision of the text model loaded when none is given, either "float32" or "int8".
+            (default is "float32")
+        gcn_precision : str, optional
+            The type of the GCN weights and activations, either "float32", "bfloat16" or "float16".
+            (default is "float32")
+        output_precision : str, optional
+            The type of the encoded features, either "float32" or "float16" which halves their memory.
+            (default is "float32")
+        subtree_cache_size : int, optional
+            The number of input feature rows kept by the cache of repeated subtrees, 0 disables the cache.
+            (default is SUBTREE_CACHE_SIZE)
+        gcn_backend : str, optional
+            Either "traced", which runs an InferenceGCNEncoder compiled with TorchScript, or "eager" which runs the
+            trained torch_geometric model as is. Graphs that are not forests always run the eager model.
+            (default is "traced")
+        """
+        # torch_geometric is slow to import, so it is only imported once a model is needed
+        from torch_geometric.nn import GAE
+        assert text_precision in TEXT_PRECISIONS, f"Unknown text precision [{text_precision}]."
+        assert gcn_precision in GCN_PRECISIONS, f"Unknown GCN precision [{gcn_precision}]."
+        assert output_precision in OUTPUT_PRECISIONS, f"Unknown output precision [{output_precision}]."
+        assert gcn_backend in GCN_BACKENDS, f"Unknown GCN backend [{gcn_backend}]."
+        self.tag_embedding_model = tag_embedding_model or TagEmbeddingModel()
+        self.text_embedding_model = text_embedding_model or TextEmbeddingModel(precision=text_precision)
+        self.gcn_dtype = GCN_PRECISIONS[gcn_precision]
+        self.output_dtype = OUTPUT_PRECISIONS[output_precision]
+        self.subtree_cache = SubtreeFeatureCache(subtree_cache_size) if subtree_cache_size else None
 
         num_features = TAG_DIMS + TEXT_DIMS
-        hidden = 128
+        hidden = HIDDEN_CHANNELS
         out_channels = EMBEDDING_DIMENSIONS
         encoder = GCNEncoder(input_channels=num_features, hidden_channels=hidden, output_channels=out_channels, num_layers=6, alpha=0.1, theta=0.5, shared_weights=True, dropout=0.1)
         self.model = GAE(encoder)
@@ -68,77 +417,325 @@ class WebGraphAutoEncoder:
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model.load_state_dict(torch.load(MODEL_PATH, map_location=self.device))
         self.model.eval()
-        self.model = self.model.to(self.device)
+        self.model = self.model.to(self.device, self.gcn_dtype)
+        self.inference_encoder = self.trace_encoder() if gcn_backend == "traced" else None
 
-    def extract(self, tree):
-        root = tree.getroot()
+    def trace_encoder(self):
+        """
+        Compiles an InferenceGCNEncoder of the model with TorchScript, tracing it over a small example forest.
 
-        # List of formatting tags we want to remove
-        formatting_tags = ['b', 'i', 'u', 'strong', 'em', 'mark', 'small', 'del', 'ins']
+        Returns:
+        --------
+        torch.jit.ScriptModule
+            The compiled encoder, taking the input features, the parent of each node and the roots of the forest.
+        """
+        encoder = InferenceGCNEncoder(self.model.encoder).eval()
+        x = torch.zeros((3, TEXT_DIMS + TAG_DIMS), dtype=self.gcn_dtype, device=self.device)
+        parents, roots = tree_adjacency(torch.tensor([[0], [1]]), 3)
+        with torch.no_grad():
+            return torch.jit.trace(encoder, (x, parents.to(self.device), roots.to(self.device)))
 
-        etree.strip_tags(root, *formatting_tags)
+    def extract(self, tree, max_memory=None):
+        graph = self.build_graph(tree)
+        if max_memory:
+            return self.encode_graph_streaming(graph, max_memory), graph.paths
+        features = self.encode_graphs([graph])[0]
+        return features, graph.paths
 
-        stack = [(root, 0)]
-        exclude_tag_lookup = set(exclude_html_tags)
-        tag_lookup = set(html_tags)
-        assert tree, "Could not create tree"
+    def extract_batch(self, trees):
+        """
+        Encodes several HTML trees with a single text embedding call and a single GCN forward pass.
 
-        i = 0
-        texts = [""]
-        tags = [root.tag]
-        edge_index = []
-        paths = [tree.getpath(root)]
-        while stack:
-            element, parent_id = stack.pop(0)
-
-            for index, child in enumerate(element):
-                if isinstance(child, etree._Comment):
-                    continue
-
-                while child.tag == "div" and len(child) == 1:
-                    child = child[0]
-
-                if child.tag not in exclude_tag_lookup:
-                    tag = child.tag
-                    if tag not in tag_lookup:
-                        tag = "div"
-                    tags.append(tag)
-                    text = self.extract_text(child)[:256]
-                    texts.append(text)
-                    paths.append(tree.getpath(child))
-                    i += 1
-                    edge_index.append([parent_id, i])
-                    stack.append((child, i))
-
-        text_embeddings = text_embedding_model.get_text_embeddings(texts)
-        tag_embeddings = tag_embedding_model.get_tag_embedding(tags)
-        x = []
-        for i in range(len(text_embeddings)):
-            x.append(torch.concatenate((torch.from_numpy(text_embeddings[i]), tag_embeddings[i])))
-
-        input_features = torch.stack(x).to(self.device)
-        input_edge_index = torch.tensor(edge_index, dtype=torch.int64).permute(1, 0)
-        input_edge_index = input_edge_index.to(self.device)
+        The graphs of all trees are packed into one disjoint union, so the results are the same as calling
+        `extract` on each tree, while the per-call model overhead is only paid once for the whole batch.
 
-        with torch.no_grad():
-            features = self.model.encode(input_features, edge_index=input_edge_index).cpu().detach()
-        torch.cuda.empty_cache()
-        del input_features, input_edge_index
-        return features, paths
+        Parameters:
+        -----------
+        trees : list of lxml.etree.ElementTree
+            The parsed HTML trees to encode.
+
+        Returns:
+        --------
+        list of tuple
+            A (features, paths) tuple for each tree, in the order the trees were given.
+        """
+        graphs = [self.build_graph(tree) for tree in trees]
+        features = self.encode_graphs(graphs)
+        return [(feature, graph.paths) for feature, graph in zip(features, graphs)]
+
+    def build_graph(self, tree):
+        return build_graph(tree)
+
+    def encode_graphs(self, graphs):
+        """
+        Runs the text, tag and GCN models over one or more graphs at once.
+
+        Parameters:
+        -----------
+        graphs : list of WebGraph
+            The graphs to encode.
+
+        Returns:
+        --------
+        list of torch.Tensor
+            The encoded node features of each graph.
+        """
+        features = self.run_gcn(self.embed_graphs(graphs), union_edge_index(graphs))
+        return list(torch.split(features, [len(graph) for graph in graphs]))
+
+    def embed_graphs(self, graphs):
+        """
+        Builds the GCN input features of the nodes of one or more graphs.
+
+        The features of the subtrees found in the subtree cache, or repeated within the graphs, are copied instead
+        of being embedded again.
+
+        Parameters:
+        -----------
+        graphs : list of WebGraph
+            The graphs to embed.
+
+        Returns:
+        --------
+        torch.Tensor
+            The input features of the nodes of the disjoint union of the graphs.
+        """
+        texts = []
+        for graph in graphs:
+            texts.extend(graph.texts)
+        tag_ids = np.concatenate([graph.tag_ids for graph in graphs])
+        if self.subtree_cache is None:
+            return self.embed(texts, tag_ids)
+
+        with stage("subtrees"):
+            lookup = self.subtree_cache.lookup(graphs)
+        stats = current_stats()
+        if stats is not None:
+            stats.subtree_hits += lookup.hits
+            stats.subtree_misses += lookup.misses
+            stats.reused_nodes += lookup.reused
+        if not lookup.reused:
+            input_features = self.embed(texts, tag_ids)
+        else:
+            missing = lookup.missing
+            input_features = torch.empty((len(texts), TEXT_DIMS + TAG_DIMS), dtype=torch.float32)
+            if len(missing):
+                input_features[torch.from_numpy(missing)] = self.embed([texts[i] for i in missing], tag_ids[missing])
+        with stage("subtrees"):
+            self.subtree_cache.resolve(lookup, input_features)
+        return input_features
+
+    def encode_graph_streaming(self, graph, max_memory, text_batch_size=TEXT_BATCH_SIZE):
+        """
+        Encodes a graph in partitions, so that the memory used by the models stays under a cap.
+
+        The nodes are split into subtrees (ranges of a depth first order). Each partition is extended with the
+        halo of upstream nodes within the GCN's receptive field (one hop per layer), its texts are embedded in
+        fixed size batches and the GCN runs over the partition's subgraph only, keeping the outputs of the
+        partition's own nodes. The result matches `encode_graphs` up to floating point error.
+
+        Parameters:
+        -----------
+        graph : WebGraph
+            The graph to encode.
+        max_memory : int
+            The maximum number of bytes used by the input features and GCN activations of a partition.
+        text_batch_size : int, optional
+            The number of texts embedded at once. (default is TEXT_BATCH_SIZE)
+
+        Returns:
+        --------
+        torch.Tensor
+            The encoded features of each node.
+        """
+        from torch_geometric.utils import k_hop_subgraph
+        hops = len(self.model.encoder.convs)
+        bytes_per_node = 4 * (TEXT_DIMS + TAG_DIMS + (hops + 2) * HIDDEN_CHANNELS)
+        max_nodes = max_memory // bytes_per_node
+        assert max_nodes > hops, f"A memory cap of {max_memory} bytes is too small to encode a single node."
+
+        edge_index = union_edge_index([graph])
+        order = torch.from_numpy(graph.preorder())
+        features = torch.empty((len(graph), EMBEDDING_DIMENSIONS), dtype=self.output_dtype)
+        start, size = 0, max_nodes
+        while start < len(graph):
+            # Shrink the partition until it fits in memory with its halo
+            while True:
+                nodes = order[start:start + size]
+                subset, sub_edge_index, mapping, _ = k_hop_subgraph(nodes, hops, edge_index, relabel_nodes=True,
+                                                                    num_nodes=len(graph))
+                if len(subset) <= max_nodes or size == 1:
+                    break
+                size //= 2
+
+            input_features = torch.empty((len(subset), TEXT_DIMS + TAG_DIMS), dtype=torch.float32)
+            subset_ids = subset.numpy()
+            for batch in range(0, len(subset), text_batch_size):
+                batch_ids = subset_ids[batch:batch + text_batch_size]
+                input_features[batch:batch + len(batch_ids)] = self.embed([graph.texts[i] for i in batch_ids],
+                                                                          graph.tag_ids[batch_ids])
+            features[nodes] = self.run_gcn(input_features, sub_edge_index)[mapping]
+            del input_features
+
+            start += len(nodes)
+            size = max_nodes
+        return features
+
+    def update_graph(self, graph, features, new_graph):
+        """
+        Encodes a new version of a graph, reusing everything that the changes can not have affected.
+
+        Nodes are matched on their XPath. The GCN is only run over the nodes within its receptive field (one hop
+        per layer) of a node whose text, tag or parent changed, and only the input features of that subgraph are
+        built. The texts that did not change are answered by the text embedding cache, so only the changed ones
+        reach the text model.
+
+        Parameters:
+        -----------
+        graph : WebGraph
+            The previous version of the graph.
+        features : torch.Tensor
+            The encoded node features of the previous version.
+        new_graph : WebGraph
+            The new version of the graph.
+
+        Returns:
+        --------
+        tuple
+            The (features, updated) of the new graph, where updated holds the ids of the nodes whose encoded
+            features were recomputed.
+        """
+        from torch_geometric.utils import k_hop_subgraph
+        with stage("diff"):
+            reused, seeds = self._diff_graphs(graph, new_graph)
+
+        kept = reused >= 0
+        new_features = torch.empty((len(new_graph), features.size(1)), dtype=features.dtype)
+        new_features[kept] = features[reused[kept]]
+        if not seeds:
+            return new_features, torch.empty(0, dtype=torch.int64)
+
+        edge_index = union_edge_index([new_graph])
+        hops = len(self.model.encoder.convs)
+        updated, _, _, _ = k_hop_subgraph(torch.tensor(seeds), hops, edge_index, num_nodes=len(new_graph),
+                                          flow="target_to_source")
+        if 2 * len(updated) > len(new_graph):
+            # Most of the graph is affected, a single full pass is cheaper than extracting the subgraph
+            return self.encode_graphs([new_graph])[0], torch.arange(len(new_graph))
+
+        subset, sub_edge_index, mapping, _ = k_hop_subgraph(updated, hops, edge_index, relabel_nodes=True,
+                                                            num_nodes=len(new_graph), flow="source_to_target")
+        subset_ids = subset.numpy()
+        input_features = self.embed([new_graph.texts[i] for i in subset_ids], new_graph.tag_ids[subset_ids])
+        new_features[updated] = self.run_gcn(input_features, sub_edge_index)[mapping]
+        return new_features, updated
+
+    def _diff_graphs(self, graph, new_graph):
+        # Matches the nodes of the new graph to the previous one, finding the nodes whose features the changes
+        # can affect
+        old_rows = {path: i for i, path in enumerate(graph.paths)}
+        old_parents = graph.parents()
+        new_parents = new_graph.parents()
+
+        reused = torch.full((len(new_graph),), -1, dtype=torch.int64)
+        seeds = []
+        old_tag_ids, new_tag_ids = graph.tag_ids.tolist(), new_graph.tag_ids.tolist()
+        for i, path in enumerate(new_graph.paths):
+            j = old_rows.get(path)
+            if j is None or graph.texts[j] != new_graph.texts[i] or old_tag_ids[j] != new_tag_ids[i]:
+                seeds.append(i)
+                continue
+
+            reused[i] = j
+            new_parent, old_parent = new_parents[i], old_parents[j]
+            if (new_parent < 0 or old_parent < 0) and new_parent != old_parent:
+                seeds.append(i)
+            elif new_parent >= 0 and new_graph.paths[new_parent] != graph.paths[old_parent]:
+                # The node itself is unchanged but it now aggregates a different parent
+                seeds.append(i)
+
+        return reused, seeds
+
+    def embed(self, texts, tag_ids):
+        """
+        Builds the GCN input features of nodes from their texts and tag ids.
+
+        Parameters:
+        -----------
+        texts : list of str
+            The cleaned text of each node.
+        tag_ids : numpy.ndarray
+            The HTML tag id of each node.
+
+        Returns:
+        --------
+        torch.Tensor
+            A 2D tensor holding the concatenated text and tag embeddings of each node.
+        """
+        stats = current_stats()
+        if stats is not None:
+            stats.texts += len(texts)
+            stats.unique_texts += len(set(texts))
+
+        # The text and tag embeddings are written straight into their columns of a single buffer
+        input_features = torch.empty((len(texts), TEXT_DIMS + TAG_DIMS), dtype=torch.float32)
+        self.text_embedding_model.get_text_embeddings(texts, out=input_features.numpy()[:, :TEXT_DIMS])
+        with stage("tags"):
+            self.tag_embedding_model.get_tag_embedding_by_id(torch.from_numpy(tag_ids),
+                                                             out=input_features[:, TEXT_DIMS:])
+        return input_features
+
+    def run_gcn(self, input_features, edge_index):
+        """
+        Runs the GCN encoder over a graph.
+
+        Parameters:
+        -----------
+        input_features : torch.Tensor
+            The input features of each node.
+        edge_index : torch.Tensor
+            The [2, E] tensor of [parent, child] edges.
+
+        Returns:
+        --------
+        torch.Tensor
+            The encoded features of each node.
+        """
+        stats = current_stats()
+        if stats is not None:
+            stats.nodes += len(input_features)
+            if self.device.type == "cuda":
+                torch.cuda.reset_peak_memory_stats(self.device)
+
+        with stage("gcn"):
+            input_features = input_features.to(self.device, self.gcn_dtype)
+            adjacency = None
+            if self.inference_encoder is not None:
+                adjacency = tree_adjacency(edge_index, len(input_features))
+
+            with torch.no_grad():
+                if adjacency is not None:
+                    parents, roots = adjacency
+                    features = self.inference_encoder(input_features, parents.to(self.device), roots.to(self.device))
+                else:
+                    features = self.model.encode(input_features, edge_index=edge_index.to(self.device))
+            features = features.cpu().detach().to(self.output_dtype)
+
+        if stats is not None:
+            if self.device.type == "cuda":
+                stats.add_memory(torch.cuda.max_memory_allocated(self.device))
+            else:
+                # Each layer keeps its input, the initial features and its output alive
+                hidden = input_features.element_size() * len(input_features) * HIDDEN_CHANNELS
+                stats.add_memory(input_features.nbytes + 3 * hidden + features.nbytes)
+        if self.device.type == "cuda":
+            with stage("empty_cache"):
+                torch.cuda.empty_cache()
+        del input_features
+        return features
 
     def clean_text(self, text):
-        if not text:
-            return
-        cleaned_text = ' '.join(re.sub(r'[^a-zA-Z\s.,!?\'\";:]', '', text).split())
-        return cleaned_text
+        return clean_text(text)
 
     def extract_text(self, element) -> str:
-        text = self.clean_text(element.text)
-        if text:
-            return text
-
-        for label in ["alt", "tite", "aria-label"]:
-            text = self.clean_text(element.get(label))
-            if text:
-                return text
-        return ""
+        return extract_text(element)